@@ -4,19 +4,24 @@ Executes workflow configurations from the frontend and returns AI responses.
 """
 
 import os
+import json
+import asyncio
 import logging
-from contextlib import asynccontextmanager
+import functools
+from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, Header, Depends
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from pydantic import AliasChoices, BaseModel, Field
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from workflow_executor import WorkflowExecutor, DocumentEmbeddingService
+from workflow_executor import WorkflowExecutor, DocumentEmbeddingService, get_embedding_service
 
 # Load environment variables
 load_dotenv()
@@ -28,7 +33,16 @@ logger = logging.getLogger(__name__)
 # Global instances
 executor: Optional[WorkflowExecutor] = None
 embedding_service: Optional[DocumentEmbeddingService] = None
-openai_client: Optional[OpenAI] = None
+openai_client: Optional[AsyncOpenAI] = None
+
+# Upper bound on a single OpenAI request from an endpoint, in seconds
+OPENAI_TIMEOUT = 30.0
+
+
+@functools.lru_cache(maxsize=32)
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    """Get a cached async OpenAI client (and its connection pool) for a key."""
+    return AsyncOpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT)
 
 
 @asynccontextmanager
@@ -37,11 +51,11 @@ async def lifespan(app: FastAPI):
     global executor, embedding_service, openai_client
     logger.info("Starting AI Workflow Service...")
     executor = WorkflowExecutor()
-    embedding_service = DocumentEmbeddingService()
+    embedding_service = get_embedding_service()
     
     api_key = os.getenv("OPENAI_API_KEY")
     if api_key:
-        openai_client = OpenAI(api_key=api_key)
+        openai_client = get_async_openai_client(api_key)
     else:
         logger.info("OPENAI_API_KEY not found in environment. Users will need to provide their own keys for TTS.")
         
@@ -100,9 +114,10 @@ class WorkflowNode(BaseModel):
 class Connection(BaseModel):
     id: str
     sourceNodeId: str
-    sourcePortId: str
+    # Port ids also accepted in snake_case, so the executor reads one attribute
+    sourcePortId: str = Field(default="", validation_alias=AliasChoices("sourcePortId", "source_port_id"))
     targetNodeId: str
-    targetPortId: str
+    targetPortId: str = Field(default="", validation_alias=AliasChoices("targetPortId", "target_port_id"))
 
 
 class WorkflowConfig(BaseModel):
@@ -210,6 +225,66 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Execute a chat interaction, streaming the AI response as it is generated.
+    
+    Returns newline-delimited JSON: {"type": "token", "content": ...} events
+    while the AI model generates, then one {"type": "done", ...} event with the
+    same fields as /chat (or {"type": "error", "detail": ...}). Clients can
+    start speaking the first sentence before the response is complete.
+    
+    Tokens come only from AI nodes that produce the answer (connected to an
+    output node); internal ones such as classifiers feeding an if-condition
+    are not streamed.
+    """
+    if executor is None:
+        raise HTTPException(status_code=503, detail="Service not initialized")
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def on_token(token: str) -> None:
+        await queue.put({"type": "token", "content": token})
+    
+    async def run_workflow() -> None:
+        start_time = datetime.now()
+        try:
+            result = await executor.execute(
+                message=request.message,
+                workflow=request.workflow,
+                conversation_history=request.conversation_history,
+                session_id=request.session_id,
+                openai_api_key=request.openai_api_key,
+                on_token=on_token,
+            )
+            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            await queue.put({
+                "type": "done",
+                "response": result.get("response", "No response generated"),
+                "model_used": result.get("model_used"),
+                "processing_time_ms": processing_time,
+                "nodes_executed": result.get("nodes_executed", []),
+            })
+        except Exception as e:
+            logger.exception("Error executing workflow")
+            await queue.put({"type": "error", "detail": str(e)})
+    
+    async def events():
+        task = asyncio.create_task(run_workflow())
+        try:
+            while True:
+                event = await queue.get()
+                yield json.dumps(event) + "\n"
+                if event["type"] != "token":
+                    break
+        finally:
+            # Client disconnected mid-stream: stop generating
+            task.cancel()
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.post("/validate")
 async def validate_workflow(workflow: WorkflowConfig):
     """
@@ -250,7 +325,8 @@ async def get_workflow_type(workflow: WorkflowConfig):
 async def text_to_speech(request: TTSRequest):
     """
     Convert text to speech using OpenAI TTS.
-    Returns an MP3 audio stream.
+    Returns an MP3 audio stream, forwarded as it is synthesized so playback
+    can start before the whole clip is ready.
     """
     # Use request-provided key or server-wide key if available
     api_key = request.openai_api_key or os.getenv("OPENAI_API_KEY")
@@ -259,19 +335,33 @@ async def text_to_speech(request: TTSRequest):
         raise HTTPException(status_code=400, detail="OpenAI API key is required. Configure it in Settings.")
 
     try:
-        # Create a temporary client if using a request-specific key
-        # or use the global client if it exists and matches
+        # Use the client for a request-specific key, or the global client if it exists
         client = openai_client
         if request.openai_api_key or not client:
-            client = OpenAI(api_key=api_key)
-
-        response = client.audio.speech.create(
-            model=request.model,
-            voice=request.voice,
-            input=request.text,
+            client = get_async_openai_client(api_key)
+
+        # Open the upstream stream here so request errors still become a 500.
+        # It is closed when the body generator finishes or fails, and by the
+        # background task, which also runs after a client disconnect
+        stack = AsyncExitStack()
+        response = await stack.enter_async_context(
+            client.audio.speech.with_streaming_response.create(
+                model=request.model,
+                voice=request.voice,
+                input=request.text,
+            )
         )
         
-        return StreamingResponse(response.iter_bytes(), media_type="audio/mpeg")
+        async def audio_chunks():
+            async with stack:
+                async for chunk in response.iter_bytes():
+                    yield chunk
+        
+        return StreamingResponse(
+            audio_chunks(),
+            media_type="audio/mpeg",
+            background=BackgroundTask(stack.aclose),
+        )
         
     except Exception as e:
         logger.exception("Error in TTS generation")
@@ -330,7 +420,9 @@ async def embed_documents(request: EmbedDocumentsRequest):
         raise HTTPException(status_code=503, detail="Service not initialized")
     
     try:
-        result = embedding_service.embed_documents(
+        # Indexing blocks on file IO and embedding requests; keep it off the event loop
+        result = await run_in_threadpool(
+            embedding_service.embed_documents,
             documents_path=request.documents_path,
             user_id=request.user_id,
             project_id=request.project_id,
@@ -350,7 +442,8 @@ async def query_documents(request: QueryDocumentsRequest):
         raise HTTPException(status_code=503, detail="Service not initialized")
     
     try:
-        result = embedding_service.query_documents(
+        result = await run_in_threadpool(
+            embedding_service.query_documents,
             query=request.query,
             user_id=request.user_id,
             project_id=request.project_id,
@@ -371,7 +464,8 @@ async def delete_index(request: DeleteIndexRequest):
         raise HTTPException(status_code=503, detail="Service not initialized")
     
     try:
-        result = embedding_service.delete_index(
+        result = await run_in_threadpool(
+            embedding_service.delete_index,
             user_id=request.user_id,
             project_id=request.project_id,
         )
@@ -385,10 +479,14 @@ if __name__ == "__main__":
     import uvicorn
     
     port = int(os.getenv("AI_SERVICE_PORT", "8000"))
+    # More than one worker process serves requests in parallel; reload only
+    # works with a single process, so it is kept for that (development) case
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=port,
-        reload=True,
+        workers=workers,
+        reload=workers == 1,
         log_level="info",
     )
@@ -4,14 +4,44 @@ Handles check-in data logging to Google Sheets using gspread library.
 """
 
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import os
 
 # Bangkok timezone (UTC+07:00)
 BANGKOK_TZ = timezone(timedelta(hours=7))
 
+# Max pooled HTTPS connections kept open to the Google APIs
+HTTP_POOL_SIZE = 20
+
+# Grid size for new daily worksheets. Sized up front so a day's appends never
+# need the grid to grow.
+DAILY_ROW_CAPACITY = 2000
+DAILY_COLUMN_COUNT = 10
+
+
+def _quote_sheet_title(title: str) -> str:
+    """Quote a worksheet title for A1 notation, doubling any single quotes in it"""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def _rows_to_records(rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Convert raw worksheet rows into records keyed by the header row,
+    matching the output of gspread's get_all_records
+    """
+    if not rows:
+        return []
+    headers = rows[0]
+    records = []
+    for row in rows[1:]:
+        values = gspread.utils.numericise_all(row + [""] * (len(headers) - len(row)))
+        records.append(dict(zip(headers, values)))
+    return records
+
 
 class GoogleSheetsService:
     """Service for logging check-in/check-out data to Google Sheets"""
@@ -53,11 +83,14 @@ class GoogleSheetsService:
                 return False
             
             # Authorize and create client
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(
-                self.credentials_file, 
-                scope
+            credentials = Credentials.from_service_account_file(
+                self.credentials_file,
+                scopes=scope
             )
-            self.client = gspread.authorize(credentials)
+            # AuthorizedSession pools connections so TLS setup is reused across calls
+            session = AuthorizedSession(credentials)
+            session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+            self.client = gspread.Client(auth=credentials, session=session)
             
             # Open spreadsheet (create if doesn't exist)
             try:
@@ -69,21 +102,24 @@ class GoogleSheetsService:
                 print(f"✅ Created new spreadsheet: {self.spreadsheet_name}")
             
             # Select or create a worksheet for today's date (YYYY-MM-DD)
+            # One metadata fetch covers both the hit and the miss case
             sheet_title = datetime.now(BANGKOK_TZ).strftime("%Y-%m-%d")
-            try:
-                self.worksheet = self.spreadsheet.worksheet(sheet_title)
+            worksheets_by_title = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+            self.worksheet = worksheets_by_title.get(sheet_title)
+            if self.worksheet:
                 print(f"✅ Opened existing worksheet: {sheet_title}")
-            except Exception:
+            else:
                 # Create new worksheet for the date
                 try:
-                    self.worksheet = self.spreadsheet.add_worksheet(title=sheet_title, rows="1000", cols="10")
+                    self.worksheet = self.spreadsheet.add_worksheet(
+                        title=sheet_title,
+                        rows=DAILY_ROW_CAPACITY,
+                        cols=DAILY_COLUMN_COUNT,
+                    )
                     print(f"✅ Created worksheet: {sheet_title}")
-                except Exception as e:
-                    # Fallback to first sheet
-                    try:
-                        self.worksheet = self.spreadsheet.sheet1
-                    except Exception:
-                        self.worksheet = None
+                except gspread.exceptions.APIError:
+                    # Fallback to first existing sheet
+                    self.worksheet = next(iter(worksheets_by_title.values()), None)
 
             # Initialize headers for the selected worksheet if available
             if self.worksheet:
@@ -117,12 +153,69 @@ class GoogleSheetsService:
             print("⚠️ Google Sheets not initialized.")
             return []
         
+        return self._batch_get_records([self.worksheet.title]).get(self.worksheet.title, [])
+    
+    def get_records_for_range(self, start_date: date, end_date: date) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Retrieve records from the daily worksheets between two dates (inclusive)
+        
+        All days are fetched with a single values.batchGet request.
+        
+        Args:
+            start_date: First day to include
+            end_date: Last day to include
+            
+        Returns:
+            Dict mapping worksheet title (YYYY-MM-DD) to its records;
+            days without a worksheet are omitted
+        """
+        if not self.is_initialized or not self.spreadsheet:
+            print("⚠️ Google Sheets not initialized.")
+            return {}
+        
         try:
-            records = self.worksheet.get_all_records()
-            return records
+            existing_titles = {ws.title for ws in self.spreadsheet.worksheets()}
         except Exception as e:
             print(f"❌ Error reading from Google Sheets: {str(e)}")
-            return []
+            return {}
+        
+        titles = []
+        day = start_date
+        while day <= end_date:
+            title = day.strftime("%Y-%m-%d")
+            if title in existing_titles:
+                titles.append(title)
+            day += timedelta(days=1)
+        
+        return self._batch_get_records(titles)
+    
+    def _batch_get_records(self, titles: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetch several worksheets in one values.batchGet call and parse them into records
+        
+        Args:
+            titles: Worksheet titles to read
+            
+        Returns:
+            Dict mapping worksheet title to its records
+        """
+        if not titles:
+            return {}
+        
+        try:
+            # A range naming only the sheet reads its used range: every row and
+            # column with data, whichever column it is in
+            ranges = [_quote_sheet_title(title) for title in titles]
+            response = self.spreadsheet.values_batch_get(ranges)
+        except Exception as e:
+            print(f"❌ Error reading from Google Sheets: {str(e)}")
+            return {}
+        
+        # valueRanges come back in the same order as the requested ranges
+        return {
+            title: _rows_to_records(value_range.get("values", []))
+            for title, value_range in zip(titles, response.get("valueRanges", []))
+        }
     
     def clear_all_data(self, keep_headers: bool = True) -> bool:
         """
@@ -140,8 +233,11 @@ class GoogleSheetsService:
         
         try:
             if keep_headers:
-                # Clear from row 2 onwards
-                self.worksheet.delete_rows(2, self.worksheet.row_count)
+                # Clear values from row 2 onwards; a values.clear keeps the grid intact.
+                # The range is open-ended (e.g. "A2:J") so it never wraps back to row 1.
+                if self.worksheet.row_count > 1:
+                    last_column = gspread.utils.rowcol_to_a1(1, self.worksheet.col_count).rstrip("0123456789")
+                    self.worksheet.batch_clear([f"A2:{last_column}"])
                 print("✅ Cleared all data (kept headers)")
             else:
                 # Clear everything
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# Modules live next to this directory (run as `python main.py`, not a package)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Manual scripts that call external APIs at import time
+collect_ignore = ["test_elevenlabs.py", "test_tts_openai.py"]
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+from langgraph.graph import END
+
+from workflow_executor import WorkflowExecutor
+
+
+def node(node_id, node_type):
+    return SimpleNamespace(id=node_id, type=node_type, data={})
+
+
+def conn(source, target, source_port="out", target_port="in"):
+    return SimpleNamespace(
+        sourceNodeId=source,
+        sourcePortId=source_port,
+        targetNodeId=target,
+        targetPortId=target_port,
+    )
+
+
+def workflow(nodes, connections):
+    return SimpleNamespace(nodes=nodes, connections=connections)
+
+
+@pytest.fixture
+def executor():
+    return WorkflowExecutor()
+
+
+def test_acyclic_nodes_added_in_topological_order(executor):
+    graph = executor._build_graph(workflow(
+        [node("out", "text-output"), node("ai", "ai-model"), node("in", "text-input")],
+        [conn("in", "ai"), conn("ai", "out")],
+    ))
+    assert list(graph.nodes) == ["in", "ai", "out"]
+    assert graph.edges == {("__start__", "in"), ("in", "ai"), ("ai", "out"), ("out", END)}
+
+
+def test_context_providers_fan_out_from_input(executor):
+    graph = executor._build_graph(workflow(
+        [
+            node("in", "text-input"),
+            node("rag", "rag-documents"),
+            node("sheets", "google-sheets"),
+            node("ai", "ai-model"),
+            node("out", "text-output"),
+        ],
+        [
+            conn("in", "ai"),
+            conn("rag", "ai", target_port="context"),
+            conn("sheets", "ai", target_port="context"),
+            conn("ai", "out"),
+        ],
+    ))
+    assert ("in", "ai") not in graph.edges
+    assert {("in", "rag"), ("in", "sheets"), ("rag", "ai"), ("sheets", "ai")} <= graph.edges
+
+
+def test_duplicate_connections_add_one_edge(executor):
+    graph = executor._build_graph(workflow(
+        [node("in", "text-input"), node("ai", "ai-model")],
+        [conn("in", "ai"), conn("in", "ai")],
+    ))
+    assert graph.edges == {("__start__", "in"), ("in", "ai"), ("ai", END)}
+
+
+def test_cycle_of_plain_edges_is_rejected(executor):
+    with pytest.raises(ValueError, match="cycle"):
+        executor._build_graph(workflow(
+            [node("in", "text-input"), node("a", "ai-model"), node("b", "ai-model")],
+            [conn("in", "a"), conn("a", "b"), conn("b", "a")],
+        ))
+
+
+def test_loop_through_if_condition_is_allowed(executor):
+    graph = executor._build_graph(workflow(
+        [
+            node("in", "text-input"),
+            node("ai", "ai-model"),
+            node("if", "if-condition"),
+            node("out", "text-output"),
+        ],
+        [
+            conn("in", "ai"),
+            conn("ai", "if"),
+            conn("if", "out", source_port="true"),
+            conn("if", "ai", source_port="false"),
+        ],
+    ))
+    assert list(graph.nodes)[:3] == ["in", "ai", "if"]
+    branch = graph.branches["if"]
+    (router_branch,) = branch.values()
+    assert set(router_branch.ends) == {"ai", "out", END}
+    router = router_branch.path.func
+    assert router({"condition_results": {"if": True}}) == "out"
+    assert router({"condition_results": {"if": False}}) == "ai"
+
+
+def test_entry_point_prefers_input_then_rag_then_sheets(executor):
+    graph = executor._build_graph(workflow(
+        [node("x", "text-output"), node("sheets", "google-sheets"), node("rag", "rag-documents")],
+        [],
+    ))
+    assert ("__start__", "rag") in graph.edges
+
+    graph = executor._build_graph(workflow(
+        [node("rag", "rag-documents"), node("in", "voice-input")],
+        [],
+    ))
+    assert ("__start__", "in") in graph.edges
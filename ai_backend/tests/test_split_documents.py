@@ -0,0 +1,42 @@
+import pytest
+import tiktoken
+
+import workflow_executor
+from workflow_executor import split_documents
+
+THAI = "ระบบตอบคำถามอัตโนมัติช่วยให้ลูกค้าได้รับข้อมูลอย่างรวดเร็ว " * 20
+
+
+@pytest.fixture(autouse=True)
+def byte_level_encoder(monkeypatch):
+    # One token per byte, so every Thai character (3 bytes in UTF-8) spans
+    # three tokens; avoids downloading the cl100k_base ranks
+    assert workflow_executor._ensure_faiss()
+    encoder = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(workflow_executor, "_get_token_encoder", lambda: encoder)
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(50, 10), (64, 16), (100, 0)])
+def test_thai_chunks_have_no_broken_characters(chunk_size, chunk_overlap):
+    doc = workflow_executor.Document(page_content=THAI, metadata={"source": "th.txt"})
+    chunks = split_documents([doc], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert "\ufffd" not in chunk.page_content
+        assert chunk.page_content in THAI
+        assert len(chunk.page_content.encode("utf-8")) <= chunk_size
+        assert chunk.metadata == {"source": "th.txt"}
+    # Windows still reach the end of the document
+    assert THAI.endswith(chunks[-1].page_content)
+
+
+def test_ascii_windows_unchanged():
+    text = "abcdefghij" * 10
+    chunks = split_documents([workflow_executor.Document(page_content=text, metadata={})], chunk_size=30, chunk_overlap=10)
+    assert [c.page_content for c in chunks] == [text[0:30], text[20:50], text[40:70], text[60:90], text[80:100]]
@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+import workflow_executor
+from workflow_executor import WorkflowExecutor, astream_llm
+
+
+class FakeLLM:
+    """Streams a canned reply chosen by the system prompt, word by word."""
+
+    def __init__(self, replies):
+        self.replies = replies
+
+    async def astream(self, messages):
+        for word in self.replies[messages[0].content].split(" "):
+            yield AIMessageChunk(content=word + " ")
+
+
+def node(node_id, node_type, **data):
+    return SimpleNamespace(id=node_id, type=node_type, data=data)
+
+
+def conn(source, target, source_port="out"):
+    return SimpleNamespace(sourceNodeId=source, sourcePortId=source_port, targetNodeId=target, targetPortId="in")
+
+
+def run(workflow):
+    tokens = []
+
+    async def on_token(token):
+        tokens.append(token)
+
+    result = asyncio.run(WorkflowExecutor().execute("hi", workflow, [], openai_api_key="key", on_token=on_token))
+    return "".join(tokens), result
+
+
+def test_only_output_node_tokens_are_streamed(monkeypatch):
+    llm = FakeLLM({"classify": "question", "answer": "the final answer"})
+    monkeypatch.setattr(workflow_executor, "get_chat_model", lambda *args: llm)
+    workflow = SimpleNamespace(
+        nodes=[
+            node("in", "text-input"),
+            node("classifier", "ai-model", systemPrompt="classify"),
+            node("if", "if-condition", conditionType="contains", field="response", conditionValue="question"),
+            node("answer", "ai-model", systemPrompt="answer"),
+            node("out", "text-output"),
+        ],
+        connections=[
+            conn("in", "classifier"),
+            conn("classifier", "if"),
+            conn("if", "answer", source_port="true"),
+            conn("answer", "out"),
+        ],
+    )
+
+    streamed, result = run(workflow)
+    assert streamed == "the final answer "
+    assert result["response"] == streamed
+
+
+def test_workflow_without_output_node_streams_last_ai_node(monkeypatch):
+    llm = FakeLLM({"first": "draft", "second": "final"})
+    monkeypatch.setattr(workflow_executor, "get_chat_model", lambda *args: llm)
+    workflow = SimpleNamespace(
+        nodes=[
+            node("in", "text-input"),
+            node("a", "ai-model", systemPrompt="first"),
+            node("b", "ai-model", systemPrompt="second"),
+        ],
+        connections=[conn("in", "a"), conn("a", "b")],
+    )
+    assert run(workflow)[0] == "final "
+
+
+def rate_limit_error():
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class FlakyLLM:
+    """Raises a rate-limit error after `chunks_before_error` chunks, on the first call only."""
+
+    def __init__(self, chunks_before_error):
+        self.chunks_before_error = chunks_before_error
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        for i, word in enumerate(["one", "two", "three"]):
+            if self.calls == 1 and i == self.chunks_before_error:
+                raise rate_limit_error()
+            yield AIMessageChunk(content=word)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(workflow_executor, "wait_random_exponential", lambda **kwargs: lambda retry_state: 0)
+
+
+def test_rate_limit_before_first_token_is_retried(no_backoff):
+    tokens = []
+
+    async def on_token(token):
+        tokens.append(token)
+
+    llm = FlakyLLM(chunks_before_error=0)
+    assert asyncio.run(astream_llm(llm, [], on_token)) == "onetwothree"
+    assert tokens == ["one", "two", "three"] and llm.calls == 2
+
+
+def test_rate_limit_after_tokens_is_raised(no_backoff):
+    tokens = []
+
+    async def on_token(token):
+        tokens.append(token)
+
+    llm = FlakyLLM(chunks_before_error=2)
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(astream_llm(llm, [], on_token))
+    assert tokens == ["one", "two"] and llm.calls == 1
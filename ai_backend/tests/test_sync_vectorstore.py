@@ -0,0 +1,209 @@
+import hashlib
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import workflow_executor
+from workflow_executor import MANIFEST_FILENAME, _read_manifest, search_vectorstore, sync_vectorstore
+
+DIM = 16
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic embeddings that count the texts they were asked to embed."""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 + 0.01 for b in digest[:DIM]]
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture(autouse=True)
+def one_chunk_per_document(monkeypatch):
+    # Skip tiktoken (its encoding is downloaded on first use)
+    assert workflow_executor._ensure_faiss()
+    monkeypatch.setattr(
+        workflow_executor,
+        "split_documents",
+        lambda docs: [workflow_executor.Document(page_content=d.page_content, metadata=dict(d.metadata)) for d in docs],
+    )
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    documents_dir = tmp_path / "documents"
+    documents_dir.mkdir()
+    return documents_dir, tmp_path / "index"
+
+
+def sources(vectorstore):
+    return sorted(
+        vectorstore.docstore.search(doc_id).page_content
+        for doc_id in vectorstore.index_to_docstore_id.values()
+    )
+
+
+def test_builds_then_skips_unchanged(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    (documents_dir / "b.txt").write_text("beta")
+    embeddings = StubEmbeddings()
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+    assert result["chunks_count"] == 2 and not result["up_to_date"]
+    assert sources(result["vectorstore"]) == ["alpha", "beta"]
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings, vectorstore=result["vectorstore"])
+    assert result["up_to_date"]
+    assert embeddings.embedded == 2
+
+
+def test_changed_and_removed_files(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    (documents_dir / "b.txt").write_text("beta")
+    embeddings = StubEmbeddings()
+    sync_vectorstore(documents_dir, index_path, embeddings)
+
+    (documents_dir / "a.txt").write_text("alpha two")
+    (documents_dir / "b.txt").unlink()
+    (documents_dir / "c.txt").write_text("gamma")
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+
+    vectorstore = result["vectorstore"]
+    assert sources(vectorstore) == ["alpha two", "gamma"]
+    assert vectorstore.index.ntotal == 2
+    assert set(_read_manifest(index_path)) == {"a.txt", "c.txt"}
+    assert embeddings.embedded == 4
+
+    (doc, _), = search_vectorstore(vectorstore, embeddings.embed_query("gamma"), 1)
+    assert doc.page_content == "gamma"
+
+
+def test_failed_file_is_not_reloaded(dirs, monkeypatch):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    (documents_dir / "legacy.doc").write_bytes(b"\xd0\xcf\x11\xe0 not a docx")
+    embeddings = StubEmbeddings()
+    sync_vectorstore(documents_dir, index_path, embeddings)
+    assert _read_manifest(index_path)["legacy.doc"]["ids"] == []
+
+    loaded = []
+    load = workflow_executor._load_document_files
+    monkeypatch.setattr(workflow_executor, "_load_document_files", lambda files: loaded.extend(files) or load(files))
+    saved_at = (index_path / "index.faiss").stat().st_mtime_ns
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+    assert result["up_to_date"]
+    assert loaded == []
+    assert (index_path / "index.faiss").stat().st_mtime_ns == saved_at
+
+
+def test_touched_failed_file_does_not_rewrite_index(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    embeddings = StubEmbeddings()
+    sync_vectorstore(documents_dir, index_path, embeddings)
+    saved_at = (index_path / "index.faiss").stat().st_mtime_ns
+
+    (documents_dir / "broken.docx").write_bytes(b"not a zip")
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+    assert result["up_to_date"]
+    assert (index_path / "index.faiss").stat().st_mtime_ns == saved_at
+    assert "broken.docx" in _read_manifest(index_path)
+
+
+@pytest.mark.parametrize("remove", ["files", "directory"])
+def test_empty_or_missing_directory_keeps_index(dirs, remove):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    embeddings = StubEmbeddings()
+    sync_vectorstore(documents_dir, index_path, embeddings)
+    manifest = (index_path / MANIFEST_FILENAME).read_bytes()
+
+    (documents_dir / "a.txt").unlink()
+    if remove == "directory":
+        documents_dir.rmdir()
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+
+    assert result["files_count"] == 0 and result["up_to_date"]
+    assert (index_path / MANIFEST_FILENAME).read_bytes() == manifest
+    assert sources(workflow_executor.load_vectorstore(str(index_path), embeddings)) == ["alpha"]
+
+
+def test_untracked_index_left_alone_unless_rebuilt(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    embeddings = StubEmbeddings()
+    sync_vectorstore(documents_dir, index_path, embeddings)
+    (index_path / MANIFEST_FILENAME).unlink()
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings, rebuild_untracked=False)
+    assert result["up_to_date"] and not (index_path / MANIFEST_FILENAME).exists()
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings)
+    assert not result["up_to_date"]
+    assert set(_read_manifest(index_path)) == {"a.txt"}
+
+
+def test_skips_sync_running_elsewhere_unless_waiting(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    embeddings = StubEmbeddings()
+    index_path.mkdir()
+
+    with workflow_executor._file_lock(index_path / workflow_executor.SYNC_LOCK_FILENAME):
+        result = sync_vectorstore(documents_dir, index_path, embeddings, wait=False)
+    assert result["up_to_date"] and result["vectorstore"] is None
+    assert embeddings.embedded == 0 and not (index_path / MANIFEST_FILENAME).exists()
+
+    result = sync_vectorstore(documents_dir, index_path, embeddings, wait=False)
+    assert sources(result["vectorstore"]) == ["alpha"]
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_legacy_l2_index_scores_higher_is_better(tmp_path, mmap):
+    embeddings = StubEmbeddings()
+    texts = ["alpha", "beta", "gamma"]
+    # Saved with LangChain's defaults: IndexFlatL2, unnormalized vectors
+    workflow_executor.FAISS.from_texts(texts, embeddings).save_local(str(tmp_path))
+
+    vectorstore = workflow_executor._read_vectorstore(str(tmp_path), embeddings, mmap=mmap)
+    results = search_vectorstore(vectorstore, embeddings.embed_query("beta"), 3)
+    assert results[0][0].page_content == "beta"
+    assert results[0][1] == pytest.approx(1.0)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_loaded_store_is_shared_across_embeddings_clients(dirs):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    sync_vectorstore(documents_dir, index_path, StubEmbeddings())
+
+    first = workflow_executor.load_vectorstore(str(index_path), StubEmbeddings())
+    assert workflow_executor.load_vectorstore(str(index_path), StubEmbeddings()) is first
+
+
+def test_stored_vectors_are_normalized_without_langchain_warning(dirs, recwarn):
+    documents_dir, index_path = dirs
+    (documents_dir / "a.txt").write_text("alpha")
+    (documents_dir / "b.txt").write_text("beta")
+    embeddings = StubEmbeddings()
+    vectorstore = sync_vectorstore(documents_dir, index_path, embeddings)["vectorstore"]
+
+    (documents_dir / "c.txt").write_text("gamma")
+    vectorstore = sync_vectorstore(documents_dir, index_path, embeddings, vectorstore=vectorstore)["vectorstore"]
+
+    index = vectorstore.index
+    norms = workflow_executor.np.linalg.norm(index.reconstruct_n(0, index.ntotal), axis=1)
+    assert norms == pytest.approx([1.0] * 3)
+    assert not [w for w in recwarn if "Normalizing L2" in str(w.message)]
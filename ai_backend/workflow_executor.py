@@ -6,46 +6,234 @@ Includes Google Sheets integration via gspread.
 """
 
 import os
+import re
+import csv
+import io
+import asyncio
+import contextlib
+import functools
 import logging
-from typing import Any, Dict, List, Literal, Optional, TypedDict
+import operator
+from dataclasses import dataclass
+from typing import Annotated, Any, Awaitable, Callable, Dict, FrozenSet, List, Literal, Optional, TypedDict
 from datetime import datetime
 from pathlib import Path
-import json
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import atexit
+import time
+import importlib.util
+import hashlib
+import multiprocessing
+import pickle
+import tempfile
+import threading
+import uuid
 
+try:
+    import fcntl
+except ImportError:  # Windows: index locks fall back to in-process locks
+    fcntl = None
+
+import httpx
+import openai
+import orjson
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 
-# FAISS and embedding imports
-try:
-    import faiss
-    from langchain_openai import OpenAIEmbeddings
-    from langchain_community.vectorstores import FAISS
-    from langchain_community.document_loaders import (
-        PyPDFLoader,
-        TextLoader,
-        Docx2txtLoader,
-    )
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-    FAISS_AVAILABLE = True
-except ImportError as e:
-    FAISS_AVAILABLE = False
-    logging.warning(f"FAISS/LangChain imports failed: {e}")
+# FAISS and Google Sheets dependencies are heavy, so they are imported on first
+# use rather than at startup. Workflows without RAG/Sheets nodes never load them.
+# Availability starts as None ("installed, not yet imported") or False when
+# find_spec shows a package is missing, which costs no import.
 
-# Google Sheets imports
-try:
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
-    import pandas as pd
-    GSPREAD_AVAILABLE = True
-except ImportError as e:
-    GSPREAD_AVAILABLE = False
-    logging.warning(f"gspread imports failed: {e}")
+
+def _modules_installed(*names: str) -> bool:
+    """Check that modules are importable without importing them."""
+    try:
+        return all(importlib.util.find_spec(name) is not None for name in names)
+    except ModuleNotFoundError:
+        # Raised when the parent package of a dotted name is missing
+        return False
+
+
+faiss = None
+np = None
+FAISS = None
+InMemoryDocstore = None
+PyPDFLoader = None
+TextLoader = None
+Docx2txtLoader = None
+Document = None
+tiktoken = None
+FAISS_AVAILABLE: Optional[bool] = (
+    None if _modules_installed("faiss", "langchain_community", "tiktoken") else False
+)  # Resolved by _ensure_faiss()
+
+# File extension -> LangChain loader class, populated by _ensure_faiss()
+DOCUMENT_LOADERS: Dict[str, Any] = {}
+
+# Keyword arguments for every FAISS build/load, populated by _ensure_faiss().
+# Vectors are searched by inner product (cosine similarity), so scores are
+# higher-is-better. They are L2-normalized by add_to_vectorstore() and
+# search_vectorstore() rather than by LangChain, whose normalize_L2 option
+# warns on every store created with this distance strategy.
+FAISS_STORE_KWARGS: Dict[str, Any] = {}
+# Keyword arguments for loading legacy indexes, built as unnormalized
+# IndexFlatL2 (LangChain's defaults) before FAISS_STORE_KWARGS was used
+FAISS_LEGACY_STORE_KWARGS: Dict[str, Any] = {}
+
+gspread = None
+Credentials = None
+AuthorizedSession = None
+GSPREAD_AVAILABLE: Optional[bool] = (
+    None if _modules_installed("gspread", "google.oauth2") else False
+)  # Resolved by _ensure_gspread()
+
+if FAISS_AVAILABLE is False:
+    logging.warning("FAISS/LangChain packages not installed; RAG nodes are disabled")
+if GSPREAD_AVAILABLE is False:
+    logging.warning("gspread packages not installed; Google Sheets nodes are disabled")
+
+
+def _ensure_faiss() -> bool:
+    """Import the FAISS/LangChain RAG stack on first call; return availability."""
+    global faiss, np, FAISS, InMemoryDocstore, PyPDFLoader, TextLoader, Docx2txtLoader, Document, tiktoken, FAISS_AVAILABLE
+    if FAISS_AVAILABLE is None:
+        try:
+            import faiss as _faiss
+            import numpy as _np
+            from langchain_community.vectorstores import FAISS as _FAISS
+            from langchain_community.vectorstores.utils import DistanceStrategy
+            from langchain_community.docstore.in_memory import InMemoryDocstore as _InMemoryDocstore
+            from langchain_community.document_loaders import (
+                PyPDFLoader as _PyPDFLoader,
+                PyPDFium2Loader as _PyPDFium2Loader,
+                TextLoader as _TextLoader,
+                Docx2txtLoader as _Docx2txtLoader,
+            )
+            from langchain_core.documents import Document as _Document
+            import tiktoken as _tiktoken
+        except ImportError as e:
+            FAISS_AVAILABLE = False
+            logging.warning(f"FAISS/LangChain imports failed: {e}")
+        else:
+            faiss, np, FAISS, InMemoryDocstore = _faiss, _np, _FAISS, _InMemoryDocstore
+            Document, tiktoken = _Document, _tiktoken
+            PyPDFLoader, TextLoader, Docx2txtLoader = _PyPDFLoader, _TextLoader, _Docx2txtLoader
+            # pdfium parses PDFs much faster than pypdf, so prefer it when installed
+            if importlib.util.find_spec("pypdfium2") is not None:
+                PyPDFLoader = _PyPDFium2Loader
+            DOCUMENT_LOADERS.update({
+                ".pdf": PyPDFLoader,
+                ".txt": TextLoader,
+                ".docx": Docx2txtLoader,
+                ".doc": Docx2txtLoader,
+            })
+            FAISS_STORE_KWARGS.update({
+                "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT,
+            })
+            FAISS_LEGACY_STORE_KWARGS.update({
+                "distance_strategy": DistanceStrategy.EUCLIDEAN_DISTANCE,
+            })
+            FAISS_AVAILABLE = True
+    return FAISS_AVAILABLE
+
+
+def _ensure_gspread() -> bool:
+    """Import gspread and google-auth on first call; return availability."""
+    global gspread, Credentials, AuthorizedSession, GSPREAD_AVAILABLE
+    if GSPREAD_AVAILABLE is None:
+        try:
+            import gspread as _gspread
+            from google.oauth2.service_account import Credentials as _Credentials
+            from google.auth.transport.requests import AuthorizedSession as _AuthorizedSession
+        except ImportError as e:
+            GSPREAD_AVAILABLE = False
+            logging.warning(f"gspread imports failed: {e}")
+        else:
+            gspread = _gspread
+            Credentials, AuthorizedSession = _Credentials, _AuthorizedSession
+            GSPREAD_AVAILABLE = True
+    return GSPREAD_AVAILABLE
 
 logger = logging.getLogger(__name__)
 
 
+# =============================================================================
+# Environment Configuration
+# =============================================================================
+
+# Default cap on document-parsing worker processes per server process
+LOAD_DOCUMENTS_MAX_PROCESSES = 4
+
+
+@dataclass(frozen=True)
+class EnvConfig:
+    """Environment-derived settings, read once per process."""
+    openai_api_key: Optional[str]
+    together_api_key: Optional[str]
+    openrouter_api_key: Optional[str]
+    # Index root for the /embed-documents and /query-documents endpoints
+    faiss_index_path: str
+    # Index root for RAG nodes (defaults next to this file)
+    rag_faiss_index_path: str
+    documents_storage_path: Path
+    # Worker processes for parsing large batches of documents, shared by all
+    # requests in this server process
+    load_documents_processes: int
+    # Recent conversation messages passed to the workflow as-is
+    history_window: int
+    # Upper bound on in-flight LLM requests in this process
+    max_concurrent_llm_calls: int
+
+
+@functools.lru_cache(maxsize=None)
+def get_env_config() -> EnvConfig:
+    """
+    Get the environment configuration.
+    
+    Resolved lazily on first call so values loaded by load_dotenv() after this
+    module is imported are still picked up.
+    """
+    module_dir = Path(__file__).resolve().parent
+    documents_storage_path = os.getenv("DOCUMENTS_STORAGE_PATH")
+    return EnvConfig(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        together_api_key=os.getenv("TOGETHER_API_KEY"),
+        openrouter_api_key=os.getenv("OPENROUTER_API_KEY"),
+        faiss_index_path=os.getenv("FAISS_INDEX_PATH", "./faiss_indexes"),
+        rag_faiss_index_path=os.getenv("FAISS_INDEX_PATH", str(module_dir / "faiss_indexes")),
+        documents_storage_path=(
+            Path(documents_storage_path).resolve()
+            if documents_storage_path
+            else module_dir.parent / "backend" / "uploads" / "documents"
+        ),
+        # Default: this server process's share of the CPUs (WEB_CONCURRENCY
+        # processes run side by side), at most LOAD_DOCUMENTS_MAX_PROCESSES
+        load_documents_processes=int(
+            os.getenv(
+                "LOAD_DOCUMENTS_PROCESSES",
+                str(max(1, min(
+                    LOAD_DOCUMENTS_MAX_PROCESSES,
+                    (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1"))),
+                ))),
+            )
+        ),
+        history_window=int(os.getenv("HISTORY_WINDOW_MESSAGES", "20")),
+        max_concurrent_llm_calls=int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "16")),
+    )
+
+
+def reload_env() -> EnvConfig:
+    """Re-read the environment configuration (e.g. after changing env vars)."""
+    get_env_config.cache_clear()
+    return get_env_config()
+
+
 # =============================================================================
 # Workflow Type Detection
 # =============================================================================
@@ -55,6 +243,10 @@ InputType = Literal["text", "voice"]
 OutputType = Literal["text", "voice"]
 
 
+INPUT_NODE_TYPES = frozenset({"text-input", "voice-input"})
+OUTPUT_NODE_TYPES = frozenset({"text-output", "voice-output"})
+
+
 def detect_workflow_type(nodes: List) -> Dict[str, Any]:
     """
     Detect the workflow input/output modalities based on node types.
@@ -62,8 +254,18 @@ def detect_workflow_type(nodes: List) -> Dict[str, Any]:
     Returns:
         Dict with input_type, output_type, workflow_type
     """
-    node_types = [n.type if hasattr(n, 'type') else n.get('type', '') for n in nodes]
+    # Nodes may be pydantic models or dicts, or a mix of both; check each one
+    node_types = frozenset(
+        n.type if hasattr(n, 'type') else n.get('type', '') for n in nodes
+    )
     
+    # Copy so callers can't modify the cached result
+    return dict(_workflow_type_for(node_types))
+
+
+@functools.lru_cache(maxsize=256)
+def _workflow_type_for(node_types: frozenset) -> Dict[str, Any]:
+    """detect_workflow_type() for a set of node types; memoized per set."""
     # Detect input type
     has_text_input = "text-input" in node_types
     has_voice_input = "voice-input" in node_types
@@ -91,12 +293,91 @@ def detect_workflow_type(nodes: List) -> Dict[str, Any]:
     }
 
 
+# =============================================================================
+# Condition Helpers
+# =============================================================================
+
+# Answers accepted by the isYes / isNo condition types
+AFFIRMATIVE_ANSWERS = frozenset({"yes", "y", "true", "1", "correct", "affirmative", "yeah", "yep"})
+NEGATIVE_ANSWERS = frozenset({"no", "n", "false", "0", "incorrect", "negative", "nope", "nah"})
+
+# Longer values can't match either set, so skip hashing long AI responses
+MAX_ANSWER_LENGTH = max(len(answer) for answer in AFFIRMATIVE_ANSWERS | NEGATIVE_ANSWERS)
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_condition_regex(pattern: str) -> "Optional[re.Pattern[str]]":
+    """
+    Compile a case-insensitive condition pattern, caching repeat patterns.
+    
+    Returns None for an invalid pattern, so it is not recompiled (and the
+    error re-raised) on every evaluation.
+    """
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        logger.warning(f"Invalid regex in if-condition: {pattern!r}")
+        return None
+
+
+def _condition_contains(check_value: str, value: str) -> bool:
+    return bool(value) and value.lower() in check_value.lower()
+
+
+def _condition_equals(check_value: str, value: str) -> bool:
+    return check_value.lower().strip() == value.lower().strip()
+
+
+def _condition_starts_with(check_value: str, value: str) -> bool:
+    return bool(value) and check_value.lower().strip().startswith(value.lower().strip())
+
+
+def _condition_ends_with(check_value: str, value: str) -> bool:
+    return bool(value) and check_value.lower().strip().endswith(value.lower().strip())
+
+
+def _condition_regex(check_value: str, value: str) -> bool:
+    pattern = _compile_condition_regex(value) if value else None
+    return pattern is not None and pattern.search(check_value) is not None
+
+
+def _condition_is_yes(check_value: str, value: str) -> bool:
+    answer = check_value.strip()
+    return len(answer) <= MAX_ANSWER_LENGTH and answer.lower() in AFFIRMATIVE_ANSWERS
+
+
+def _condition_is_no(check_value: str, value: str) -> bool:
+    answer = check_value.strip()
+    return len(answer) <= MAX_ANSWER_LENGTH and answer.lower() in NEGATIVE_ANSWERS
+
+
+# If-condition evaluators by conditionType: (check_value, condition value) -> bool
+CONDITION_OPERATORS: Dict[str, Callable[[str, str], bool]] = {
+    "contains": _condition_contains,
+    "equals": _condition_equals,
+    "startsWith": _condition_starts_with,
+    "endsWith": _condition_ends_with,
+    "regex": _condition_regex,
+    "isYes": _condition_is_yes,
+    "isNo": _condition_is_no,
+}
+
+
 # =============================================================================
 # State Definition
 # =============================================================================
 
+def _merge_dicts(left: Optional[Dict], right: Optional[Dict]) -> Dict:
+    """LangGraph reducer: merge a node's dict update into the existing dict."""
+    return {**(left or {}), **(right or {})}
+
+
 class WorkflowState(TypedDict):
-    """State passed through the workflow graph."""
+    """State passed through the workflow graph.
+    
+    Nodes return partial updates. Annotated fields are merged by their
+    reducer; all other fields are overwritten.
+    """
     # Input
     user_message: str
     conversation_history: List[Dict[str, str]]
@@ -107,55 +388,1057 @@ class WorkflowState(TypedDict):
     sheets_data: Optional[str]
     
     # Conditions
-    condition_results: Dict[str, bool]
+    condition_results: Annotated[Dict[str, bool], _merge_dicts]
     
     # Output
     response: str
-    nodes_executed: List[str]
+    nodes_executed: Annotated[List[str], operator.add]
     model_used: Optional[str]
     
     # Output tracking for conditions
-    output_variables: Dict[str, str]
+    output_variables: Annotated[Dict[str, str], _merge_dicts]
+    
+    # RAG troubleshooting info, returned by execute()
+    rag_debug: Annotated[Dict[str, Any], _merge_dicts]
     
     # User-provided API key
     openai_api_key: Optional[str]
+    
+    # Summary of conversation history older than conversation_history, if any.
+    # Only this (never a client-supplied message) becomes an extra system message.
+    history_summary: Optional[str]
+    
+    # Optional async callback receiving AI response text as it is generated,
+    # from the AI nodes in stream_node_ids only (see streaming_node_ids())
+    on_token: Optional[Callable[[str], Awaitable[None]]]
+    stream_node_ids: FrozenSet[str]
+    
+    # Configuration of each node (its data plus "id"), by node id. Kept out of
+    # the compiled graph so edits to node settings don't force a rebuild.
+    node_data: Dict[str, Dict[str, Any]]
+
+
+def new_workflow_state(
+    message: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    openai_api_key: Optional[str] = None,
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+    node_data: Optional[Dict[str, Dict[str, Any]]] = None,
+    stream_node_ids: FrozenSet[str] = frozenset(),
+    history_summary: Optional[str] = None,
+) -> WorkflowState:
+    """
+    Create the initial state for a run with every field set, so processors
+    can read fields by key instead of through .get() with fallback defaults.
+    """
+    return {
+        "user_message": message,
+        "conversation_history": conversation_history or [],
+        "current_context": "",
+        "rag_context": None,
+        "sheets_data": None,
+        "condition_results": {},
+        "response": "",
+        "nodes_executed": [],
+        "model_used": None,
+        "output_variables": {},  # Track AI outputs for conditions
+        "rag_debug": {},
+        "openai_api_key": openai_api_key,  # User-provided API key
+        "history_summary": history_summary,
+        "on_token": on_token,
+        "stream_node_ids": stream_node_ids,
+        "node_data": node_data or {},
+    }
+
+
+def workflow_node_data(workflow) -> Dict[str, Dict[str, Any]]:
+    """Collect each node's data, plus its id, for new_workflow_state()."""
+    return {
+        n.id: {**(n.data if isinstance(getattr(n, "data", None), dict) else {}), "id": n.id}
+        for n in workflow.nodes
+    }
+
+
+def streaming_node_ids(workflow) -> FrozenSet[str]:
+    """
+    Ids of the AI nodes whose output is the workflow's answer: those connected
+    to an output node, or with no outgoing connections when the workflow has
+    no output node. Other AI nodes (e.g. classifiers feeding an if-condition)
+    produce internal text that is not streamed to the client.
+    """
+    types = {n.id: n.type for n in workflow.nodes}
+    ai_ids = {nid for nid, node_type in types.items() if node_type == "ai-model"}
+    if not OUTPUT_NODE_TYPES.isdisjoint(types.values()):
+        return frozenset(
+            c.sourceNodeId for c in workflow.connections
+            if c.sourceNodeId in ai_ids and types.get(c.targetNodeId) in OUTPUT_NODE_TYPES
+        )
+    return frozenset(ai_ids - {c.sourceNodeId for c in workflow.connections})
+
+
+def _run_node(processor, node_id: str, state: WorkflowState) -> Dict[str, Any]:
+    """Graph node body: call a processor with this run's config for the node."""
+    return processor(state, state["node_data"][node_id])
+
+
+async def _arun_node(processor, node_id: str, state: WorkflowState) -> Dict[str, Any]:
+    """Async counterpart of _run_node() for coroutine processors."""
+    return await processor(state, state["node_data"][node_id])
+
+
+def _if_router(node_id: str, true_targets: tuple, false_targets: tuple, state: WorkflowState) -> str:
+    """Conditional edge for an if-condition node: pick the branch for its result."""
+    result = state["condition_results"].get(node_id, False)
+    logger.info("Routing from %s: condition=%s", node_id, result)
+    if result and true_targets:
+        return true_targets[0]
+    elif not result and false_targets:
+        return false_targets[0]
+    return END
 
 
 # =============================================================================
 # Document Loading Helpers
 # =============================================================================
 
+# Token-window chunking used for both explicit embedding and on-demand RAG indexing.
+# RAG_SNIPPET_CHARS is derived from the chunk size so retrieved chunks reach
+# the model whole.
+CHUNK_SIZE_TOKENS = 1000
+CHUNK_OVERLAP_TOKENS = 200
+
+_token_encoder = None
+
+
+def _get_token_encoder():
+    """Return the shared cl100k_base encoder, loading it on first use."""
+    global _token_encoder
+    if _token_encoder is None:
+        _token_encoder = tiktoken.get_encoding("cl100k_base")
+    return _token_encoder
+
+
+def split_documents(
+    documents: List,
+    chunk_size: int = CHUNK_SIZE_TOKENS,
+    chunk_overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> List:
+    """Split documents into fixed-size, overlapping token windows.
+
+    Documents are encoded in one batch and windows decoded in one batch;
+    tiktoken spreads both across threads in its Rust core. Text that looks
+    like a special token (e.g. "<|endoftext|>") is encoded as plain text.
+    Chunks never exceed the embedding model's token limit.
+    
+    A token may hold part of a multi-byte UTF-8 character (common in Thai),
+    so window edges are moved to the nearest token that starts a character;
+    cutting inside one would decode to U+FFFD.
+    """
+    enc = _get_token_encoder()
+    windows = []
+    metadatas = []
+    for doc, ids in zip(documents, enc.encode_ordinary_batch([doc.page_content for doc in documents])):
+        count = len(ids)
+        # starts_char[i]: token i begins with a character's first byte, i.e.
+        # not with a UTF-8 continuation byte (0b10xxxxxx)
+        starts_char = [token[0] & 0xC0 != 0x80 for token in enc.decode_tokens_bytes(ids)]
+        start = 0
+        while start < count:
+            end = min(start + chunk_size, count)
+            while end < count and end > start + 1 and not starts_char[end]:
+                end -= 1
+            windows.append(ids[start:end])
+            metadatas.append(doc.metadata)
+            if end >= count:
+                break
+            start = max(end - chunk_overlap, start + 1)
+            while start < end and not starts_char[start]:
+                start += 1
+    return [
+        Document(page_content=text, metadata=dict(metadata))
+        for text, metadata in zip(enc.decode_batch(windows), metadatas)
+    ]
+
+
+# PDFium is not thread-safe, so pdfium-backed loads run one at a time
+_pdfium_lock = threading.Lock()
+
+
+def _load_document_file(file_path: Path) -> List:
+    """Load a single document file, returning an empty list on failure."""
+    loader_cls = DOCUMENT_LOADERS.get(file_path.suffix.lower())
+    if loader_cls is None:
+        logger.debug(f"Skipping unsupported file: {file_path}")
+        return []
+    try:
+        if loader_cls.__name__ == "PyPDFium2Loader":
+            with _pdfium_lock:
+                return loader_cls(str(file_path)).load()
+        return loader_cls(str(file_path)).load()
+    except Exception as e:
+        logger.warning(f"Failed to load {file_path}: {e}")
+        return []
+
+
+def _load_document_file_in_process(file_path: Path) -> List:
+    """Worker-process entry point: import the loaders, then load one file."""
+    _ensure_faiss()
+    return _load_document_file(file_path)
+
+
+# Batches larger than this are parsed in worker processes; smaller ones are
+# not worth the round trip and use threads
+PROCESS_POOL_MIN_FILES = 8
+
+# Parsing pool, created on first use and shared by every sync in this process
+_document_process_pool: Optional[ProcessPoolExecutor] = None
+_document_process_pool_lock = threading.Lock()
+
+
+def _get_document_process_pool(processes: int) -> ProcessPoolExecutor:
+    global _document_process_pool
+    with _document_process_pool_lock:
+        if _document_process_pool is None:
+            # Spawn rather than fork: the server process runs threads that may hold locks
+            _document_process_pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_document_process_pool.shutdown, cancel_futures=True)
+        return _document_process_pool
+
+
+def _reset_document_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool (e.g. a worker was killed) so the next batch starts a new one."""
+    global _document_process_pool
+    with _document_process_pool_lock:
+        if _document_process_pool is pool:
+            _document_process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _load_document_files(files: List[Path]) -> List[List]:
+    """Load files concurrently so disk reads and parsing overlap across files.
+
+    Large batches are parsed in the shared worker process pool, since
+    PDF/DOCX parsing is CPU-bound and pdfium is serialized within a process.
+
+    Returns one list of documents per input file, in input order.
+    """
+    if not files:
+        return []
+    processes = get_env_config().load_documents_processes
+    if len(files) > PROCESS_POOL_MIN_FILES and processes > 1:
+        pool = _get_document_process_pool(processes)
+        try:
+            return list(pool.map(_load_document_file_in_process, files))
+        except BrokenProcessPool:
+            _reset_document_process_pool(pool)
+            raise
+    max_workers = min(32, (os.cpu_count() or 1) * 4, len(files))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_load_document_file, files))
+
+
 def load_documents_from_directory(directory_path: str) -> List:
     """Load documents from a directory, supporting PDF, DOCX, and TXT files."""
     documents = []
     path = Path(directory_path)
     
+    if not _ensure_faiss():
+        return documents
+    
     if not path.exists():
         logger.warning(f"Directory not found: {directory_path}")
         return documents
     
-    for file_path in path.iterdir():
-        if file_path.is_file():
-            try:
-                ext = file_path.suffix.lower()
-                if ext == ".pdf":
-                    loader = PyPDFLoader(str(file_path))
-                    documents.extend(loader.load())
-                elif ext == ".txt":
-                    loader = TextLoader(str(file_path))
-                    documents.extend(loader.load())
-                elif ext in [".docx", ".doc"]:
-                    loader = Docx2txtLoader(str(file_path))
-                    documents.extend(loader.load())
-                else:
-                    logger.debug(f"Skipping unsupported file: {file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to load {file_path}: {e}")
+    for docs in _load_document_files([p for p in path.iterdir() if p.is_file()]):
+        documents.extend(docs)
     
     logger.info(f"Loaded {len(documents)} documents from {directory_path}")
     return documents
 
 
+# =============================================================================
+# Vector Store Helpers
+# =============================================================================
+
+# HNSW graph parameters: neighbours per node, build-time and query-time beam width
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Index type by chunk count at build time: exact search below FLAT_INDEX_MAX_VECTORS,
+# IVF-PQ from IVFPQ_MIN_VECTORS, HNSW over 8-bit scalar-quantized vectors in between.
+# Quantizers are trained on the chunks being indexed; FAISS wants at least 39
+# training points per centroid, for both the IVF lists and the 256-entry PQ codebooks.
+FLAT_INDEX_MAX_VECTORS = 1000
+IVF_NLIST = 256
+IVFPQ_MIN_VECTORS = 39 * IVF_NLIST
+IVFPQ_FACTORY = f"IVF{IVF_NLIST},PQ32"
+IVF_NPROBE = 16
+
+
+def _new_hnsw_index(training):
+    """
+    Create an empty HNSW inner-product index storing 8-bit vectors (a quarter
+    of the memory of float32), with per-dimension ranges trained on the
+    normalized `training` array. Later vectors outside a trained range are
+    clamped to it.
+    """
+    index = faiss.IndexHNSWSQ(training.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(training)
+    return index
+
+
+def _new_faiss_index(vectors: List[List[float]]):
+    """
+    Create an empty inner-product index sized for the vectors about to be added.
+    
+    Small projects get an exact flat index. Mid-sized ones get HNSW with
+    8-bit scalar-quantized storage. Large ones get IVF-PQ. Quantizers are
+    trained here on the (normalized) vectors.
+    """
+    dim = len(vectors[0])
+    if len(vectors) < FLAT_INDEX_MAX_VECTORS:
+        return faiss.IndexFlatIP(dim)
+    training = np.asarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(training)
+    if len(vectors) >= IVFPQ_MIN_VECTORS:
+        index = faiss.index_factory(dim, IVFPQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        index.train(training)
+        index.nprobe = IVF_NPROBE
+        return index
+    return _new_hnsw_index(training)
+
+
+# Embedding requests in flight at once while indexing
+EMBEDDING_CONCURRENCY = 5
+
+
+def embed_texts(embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Embed texts with one request per EMBEDDING_BATCH_SIZE batch, running up to
+    EMBEDDING_CONCURRENCY batches concurrently instead of one after another.
+    """
+    batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return embeddings.embed_documents(texts)
+    with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as executor:
+        results = executor.map(embeddings.embed_documents, batches)
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+def build_vectorstore(
+    splits: List,
+    embeddings,
+    ids: Optional[List[str]] = None,
+    vectors: Optional[List[List[float]]] = None,
+):
+    """Index document chunks in a new FAISS store, embedding them unless `vectors` are given."""
+    if not splits:
+        raise ValueError("No document chunks to index")
+    texts = [split.page_content for split in splits]
+    if vectors is None:
+        vectors = embed_texts(embeddings, texts)
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=_new_faiss_index(vectors),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        **FAISS_STORE_KWARGS,
+    )
+    add_to_vectorstore(vectorstore, splits, vectors, ids)
+    return vectorstore
+
+
+def add_to_vectorstore(vectorstore, splits: List, vectors, ids: Optional[List[str]] = None) -> None:
+    """
+    Add embedded chunks to a store, L2-normalizing the vectors for
+    inner-product indexes (legacy L2 indexes keep them as they are).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(vectors)
+    vectorstore.add_embeddings(
+        zip([split.page_content for split in splits], vectors),
+        metadatas=[split.metadata for split in splits],
+        ids=ids,
+    )
+
+
+def _read_vectorstore(index_path: str, embeddings, mmap: bool = False):
+    """
+    Read a saved FAISS store from disk, restoring the query-time search parameters.
+    
+    With `mmap`, the index is opened read-only and memory-mapped where FAISS
+    supports it (IVF inverted lists), so hot pages are served from the OS page
+    cache instead of a private copy. Such a store cannot be modified.
+    
+    Legacy L2 indexes are loaded with FAISS_LEGACY_STORE_KWARGS, so chunks
+    added to them and queries against them are not normalized either.
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = faiss.read_index(str(Path(index_path) / "index.faiss"), flags)
+    with open(Path(index_path) / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        **(FAISS_LEGACY_STORE_KWARGS if index.metric_type == faiss.METRIC_L2 else FAISS_STORE_KWARGS),
+    )
+    if hasattr(vectorstore.index, "hnsw"):
+        vectorstore.index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif hasattr(vectorstore.index, "nprobe"):
+        vectorstore.index.nprobe = IVF_NPROBE
+    return vectorstore
+
+
+# Loaded stores kept in memory, keyed by index directory. One copy serves every
+# API key: queries are embedded by the caller (see search_vectorstore()), so a
+# cached store's own embedding_function, that of whoever loaded it, is unused.
+VECTORSTORE_CACHE_SIZE = 32
+_vectorstore_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_vectorstore_cache_lock = threading.Lock()
+
+
+def _vectorstore_cache_key(index_path) -> str:
+    # abspath rather than resolve(): no filesystem calls on the query path
+    return os.path.abspath(index_path)
+
+
+def _index_version(index_path) -> tuple:
+    """Modification times of the saved index files, used to detect rewrites."""
+    index_path = Path(index_path)
+    return (
+        (index_path / "index.faiss").stat().st_mtime_ns,
+        (index_path / "index.pkl").stat().st_mtime_ns,
+    )
+
+
+def _cache_vectorstore(index_path, vectorstore, version: Optional[tuple] = None) -> None:
+    """Remember a store that matches what is saved at `index_path` (at `version`)."""
+    key = _vectorstore_cache_key(index_path)
+    version = version or _index_version(index_path)
+    with _vectorstore_cache_lock:
+        _vectorstore_cache[key] = (version, vectorstore)
+        _vectorstore_cache.move_to_end(key)
+        while len(_vectorstore_cache) > VECTORSTORE_CACHE_SIZE:
+            _vectorstore_cache.popitem(last=False)
+
+
+def evict_vectorstore(index_path) -> None:
+    """Drop the cached store loaded from `index_path`."""
+    with _vectorstore_cache_lock:
+        _vectorstore_cache.pop(_vectorstore_cache_key(index_path), None)
+
+
+def _save_vectorstore(vectorstore, index_path: Path) -> None:
+    """
+    Save a store next to `index_path` and swap the files in with os.replace,
+    so stores memory-mapped from the previous files are never overwritten.
+    Call with the index's LOCK_FILENAME lock held exclusively.
+    """
+    index_path.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=index_path) as tmp_dir:
+        vectorstore.save_local(tmp_dir)
+        for name in ("index.pkl", "index.faiss"):
+            os.replace(Path(tmp_dir) / name, index_path / name)
+
+
+def load_vectorstore(index_path: str, embeddings, mmap: bool = False):
+    """
+    Load a saved FAISS store, reusing the in-memory copy while the files on
+    disk are unchanged.
+    
+    Cached stores are shared between requests and API keys and must be
+    treated as read-only; sync_vectorstore() updates a private copy and
+    republishes it. Embed queries with the caller's own client, not the
+    store's embedding_function.
+    """
+    key = _vectorstore_cache_key(index_path)
+    version = _index_version(index_path)
+    with _vectorstore_cache_lock:
+        cached = _vectorstore_cache.get(key)
+        if cached and cached[0] == version:
+            _vectorstore_cache.move_to_end(key)
+            return cached[1]
+    # index.faiss and index.pkl are replaced one after the other; the shared
+    # lock keeps a writer from swapping them between the two reads
+    with _file_lock(Path(index_path) / LOCK_FILENAME, exclusive=False):
+        version = _index_version(index_path)
+        vectorstore = _read_vectorstore(index_path, embeddings, mmap=mmap)
+    _cache_vectorstore(index_path, vectorstore, version)
+    return vectorstore
+
+
+_gpu_resources = None
+
+# Largest k the FAISS GPU kernels support; bigger searches run on the CPU index
+GPU_MAX_K = 2048
+
+
+def _to_gpu(index):
+    """
+    Return a GPU copy of a FAISS index when faiss-gpu and a CUDA device are
+    available, otherwise the index itself. With several devices the index is
+    sharded across all of them. Index types without a GPU implementation
+    (such as HNSW) stay on the CPU.
+    """
+    global _gpu_resources
+    if not hasattr(faiss, "StandardGpuResources"):
+        return index
+    num_gpus = faiss.get_num_gpus()
+    if num_gpus == 0:
+        return index
+    try:
+        if num_gpus > 1:
+            options = faiss.GpuMultipleClonerOptions()
+            options.shard = True
+            return faiss.index_cpu_to_all_gpus(index, co=options)
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    except RuntimeError as e:
+        logger.debug("FAISS index stays on CPU: %s", e)
+        return index
+
+
+def _search_index(vectorstore):
+    """
+    Get the index to search for a store. The GPU copy is cached on the store
+    and refreshed whenever the CPU index is replaced or resized; the store
+    itself always keeps the CPU index so it can be saved.
+    """
+    index = vectorstore.index
+    cached = getattr(vectorstore, "_search_index_cache", None)
+    if cached and cached[0] is index and cached[1] == index.ntotal:
+        return cached[2]
+    search_index = _to_gpu(index)
+    vectorstore._search_index_cache = (index, index.ntotal, search_index)
+    return search_index
+
+
+def search_vectorstore(vectorstore, query_vector: List[float], k: int) -> List[tuple]:
+    """
+    Return the top-k (document, score) pairs for an embedded query.
+    
+    Searches the FAISS index directly and looks up only the matched documents,
+    skipping LangChain's per-result filtering and wrapping. Scores are cosine
+    similarities, higher is better, for legacy L2 indexes too.
+    """
+    vector = np.asarray([query_vector], dtype=np.float32)
+    legacy = vectorstore.index.metric_type == faiss.METRIC_L2
+    if not legacy:
+        faiss.normalize_L2(vector)
+    index = _search_index(vectorstore) if k <= GPU_MAX_K else vectorstore.index
+    scores, positions = index.search(vector, k)
+    if legacy:
+        # Squared L2 distance between unit-length (OpenAI) embeddings is
+        # 2 - 2 * cosine similarity
+        scores = 1 - scores / 2
+    index_to_id = vectorstore.index_to_docstore_id
+    docstore = vectorstore.docstore
+    return [
+        (docstore.search(index_to_id[pos]), float(score))
+        for pos, score in zip(positions[0].tolist(), scores[0].tolist())
+        if pos != -1
+    ]
+
+
+def delete_from_vectorstore(vectorstore, ids: List[str]) -> None:
+    """
+    Remove chunks from a FAISS store by docstore id.
+    
+    Flat indexes delete in place. HNSW graphs cannot drop vectors, and IVF
+    keeps the original ids of the remaining vectors while LangChain renumbers
+    its position -> docstore id map, so both are rebuilt from the vectors
+    that are kept.
+    """
+    index = vectorstore.index
+    if isinstance(index, faiss.IndexFlat):
+        vectorstore.delete(ids)
+        return
+    
+    drop = set(ids)
+    positions = sorted(vectorstore.index_to_docstore_id)
+    keep = [pos for pos in positions if vectorstore.index_to_docstore_id[pos] not in drop]
+    removed = [vectorstore.index_to_docstore_id[pos] for pos in positions if vectorstore.index_to_docstore_id[pos] in drop]
+    
+    if keep and hasattr(index, "hnsw"):
+        kept_vectors = index.reconstruct_n(0, index.ntotal)[keep]
+        new_index = _new_hnsw_index(kept_vectors)
+        new_index.add(kept_vectors)
+    elif keep:
+        # IVF: keep the trained quantizers and re-add the kept vectors from position 0
+        new_index = faiss.clone_index(index)
+        new_index.reset()
+        index.make_direct_map()
+        new_index.add(index.reconstruct_n(0, index.ntotal)[keep])
+    else:
+        # Nothing left to train the quantizer on; start over like a new small store
+        new_index = faiss.IndexFlatIP(index.d)
+    
+    vectorstore.index_to_docstore_id = {
+        new_pos: vectorstore.index_to_docstore_id[old_pos] for new_pos, old_pos in enumerate(keep)
+    }
+    if removed:
+        vectorstore.docstore.delete(removed)
+    vectorstore.index = new_index
+
+
+# Shared pool for stat calls, which can take milliseconds each on network filesystems
+_probe_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="index-probe")
+
+
+def _has_index_file(index_path: str) -> bool:
+    # One stat: the directory exists if the index file does
+    return os.path.isfile(os.path.join(index_path, "index.faiss"))
+
+
+def probe_index_paths(index_paths: List[str]) -> List[bool]:
+    """Check which directories hold a saved index, probing them concurrently."""
+    if len(index_paths) <= 1:
+        return [_has_index_file(path) for path in index_paths]
+    return list(_probe_executor.map(_has_index_file, index_paths))
+
+
+# =============================================================================
+# Embedding Manifest Helpers
+# =============================================================================
+
+# Stored next to index.faiss:
+# {filename: {"sha256": str, "mtime_ns": int, "size": int, "ids": [chunk ids]}}
+MANIFEST_FILENAME = "manifest.json"
+
+# Lock files in each index directory, see _file_lock(): LOCK_FILENAME guards
+# reading and replacing the index files, SYNC_LOCK_FILENAME a whole sync
+LOCK_FILENAME = ".lock"
+SYNC_LOCK_FILENAME = ".sync.lock"
+
+# Locks used where fcntl is unavailable, by lock file path
+_thread_file_locks: Dict[str, threading.Lock] = {}
+_thread_file_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path: Path, exclusive: bool = True, blocking: bool = True):
+    """
+    Hold a lock named by `lock_path`, whose directory must exist; yields
+    whether it was acquired (always True when `blocking`).
+    
+    With fcntl this is a flock() on the file, so it excludes other threads
+    and other worker processes alike, and shared holders only exclude
+    exclusive ones. Otherwise it is a thread lock per path, and shared
+    holders are exclusive too.
+    """
+    if fcntl is None:
+        with _thread_file_locks_guard:
+            lock = _thread_file_locks.setdefault(os.path.abspath(lock_path), threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(fd, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _hash_file(file_path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(index_path: Path) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Read the embedding manifest for an index, or None if missing/unreadable."""
+    try:
+        with open(index_path / MANIFEST_FILENAME, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(index_path: Path, manifest: Dict[str, Dict[str, Any]]) -> None:
+    """Atomically write the embedding manifest for an index."""
+    tmp_path = index_path / f"{MANIFEST_FILENAME}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(manifest))
+    os.replace(tmp_path, index_path / MANIFEST_FILENAME)
+
+
+def _plan_sync(
+    files: Dict[str, Path],
+    manifest: Optional[Dict[str, Dict[str, Any]]],
+) -> tuple:
+    """
+    Compare the documents in a directory with an index manifest.
+    
+    Files whose size and mtime match the manifest are not read; others are hashed.
+    
+    Returns:
+        (new_manifest, changed, stale_ids): manifest entries of unchanged
+        files, {name: entry without "ids"} for new or modified files, and the
+        chunk ids of modified or removed files
+    """
+    manifest = manifest or {}
+    new_manifest = {}
+    changed = {}
+    for name, path in files.items():
+        stat = path.stat()
+        entry = manifest.get(name)
+        if entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            new_manifest[name] = entry
+            continue
+        digest = _hash_file(path)
+        if entry and entry.get("sha256") == digest:
+            # Touched but unchanged; refresh the stat fields only
+            new_manifest[name] = {**entry, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            continue
+        changed[name] = {"sha256": digest, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    
+    stale_ids = [
+        chunk_id
+        for name, entry in manifest.items()
+        if name not in files or name in changed
+        for chunk_id in entry.get("ids", [])
+    ]
+    return new_manifest, changed, stale_ids
+
+
+def _prepare_files(files: Dict[str, Path], changed: Dict[str, Dict[str, Any]], embeddings) -> Dict[str, tuple]:
+    """
+    Load, split and embed changed files.
+    
+    Returns:
+        {name: (manifest entry, documents_count, splits, vectors)}; files that
+        fail to load have no splits
+    """
+    names = list(changed)
+    prepared = {}
+    splits = []
+    for name, docs in zip(names, _load_document_files([files[name] for name in names])):
+        file_splits = split_documents(docs) if docs else []
+        prepared[name] = (changed[name], len(docs), file_splits)
+        splits.extend(file_splits)
+    
+    # One embedding pass over every file's chunks, then hand the vectors back per file
+    vectors = embed_texts(embeddings, [split.page_content for split in splits]) if splits else []
+    offset = 0
+    for name, (entry, documents_count, file_splits) in prepared.items():
+        prepared[name] = (entry, documents_count, file_splits, vectors[offset:offset + len(file_splits)])
+        offset += len(file_splits)
+    return prepared
+
+
+def sync_vectorstore(
+    documents_dir: Path,
+    index_path: Path,
+    embeddings,
+    vectorstore=None,
+    rebuild_untracked: bool = True,
+    wait: bool = True,
+) -> Dict[str, Any]:
+    """
+    Bring the FAISS index at `index_path` in line with the files in `documents_dir`.
+    
+    Files whose size and mtime match the manifest are skipped without reading
+    them; others are hashed, and only new or modified files are loaded, split
+    and embedded. Chunks of modified or removed files are deleted from the index.
+    Files that fail to load are recorded without chunks and retried once they
+    change. A missing or empty `documents_dir` leaves the index as it is.
+    
+    One sync per index runs at a time across threads and worker processes, so
+    changes are embedded once. Readers are only locked out while the new
+    files are saved.
+    
+    Args:
+        documents_dir: Directory containing the source documents
+        index_path: Directory holding index.faiss and its manifest
+        embeddings: Embeddings client used for new chunks
+        vectorstore: Already-loaded store for `index_path`, if any; returned
+            as-is when nothing changed, never modified in place
+        rebuild_untracked: Rebuild an index that has no manifest; if False,
+            such an index is left as it is
+        wait: Wait for a sync already running on `index_path`; if False,
+            leave the index to it and return at once
+    
+    Returns:
+        Dict with `vectorstore` (None when nothing was loaded, built or
+        passed in), `documents_count` and `chunks_count` embedded,
+        `files_count` of supported files found, and `up_to_date` when the
+        index was left unchanged
+    """
+    files = {}
+    if documents_dir.is_dir():
+        files = {
+            p.name: p for p in documents_dir.iterdir()
+            if p.is_file() and p.suffix.lower() in DOCUMENT_LOADERS
+        }
+    unchanged = {
+        "vectorstore": vectorstore,
+        "documents_count": 0,
+        "chunks_count": 0,
+        "files_count": len(files),
+        "up_to_date": True,
+    }
+    if not files:
+        # Never treat every indexed file as removed because the directory is
+        # empty or missing (e.g. storage not mounted yet)
+        return unchanged
+    
+    index_path.mkdir(parents=True, exist_ok=True)
+    with _file_lock(index_path / SYNC_LOCK_FILENAME, blocking=wait) as acquired:
+        if not acquired:
+            return unchanged
+        
+        has_index = (index_path / "index.faiss").exists()
+        manifest = _read_manifest(index_path) if has_index else None
+        if has_index and manifest is None and not rebuild_untracked:
+            return unchanged
+        
+        new_manifest, changed, stale_ids = _plan_sync(files, manifest)
+        if manifest is not None and not changed and not stale_ids and new_manifest == manifest:
+            return unchanged
+        prepared = _prepare_files(files, changed, embeddings)
+        
+        documents_count = 0
+        splits = []
+        vectors = []
+        split_ids = []
+        for name, (entry, file_documents, file_splits, file_vectors) in prepared.items():
+            file_ids = [str(uuid.uuid4()) for _ in file_splits]
+            documents_count += file_documents
+            splits.extend(file_splits)
+            vectors.extend(file_vectors)
+            split_ids.extend(file_ids)
+            new_manifest[name] = {**entry, "ids": file_ids}
+        
+        incremental = manifest is not None
+        if incremental and not splits and not stale_ids:
+            # Only stat fields or files that failed to load changed
+            _write_manifest(index_path, new_manifest)
+            return unchanged
+        
+        if incremental:
+            # Update a private copy; the loaded store may be shared through the cache
+            vectorstore = _read_vectorstore(str(index_path), embeddings)
+            if stale_ids:
+                delete_from_vectorstore(vectorstore, stale_ids)
+            if splits:
+                add_to_vectorstore(vectorstore, splits, vectors, split_ids)
+        elif splits:
+            vectorstore = build_vectorstore(splits, embeddings, ids=split_ids, vectors=vectors)
+        else:
+            return {**unchanged, "vectorstore": None, "up_to_date": False}
+        
+        with _file_lock(index_path / LOCK_FILENAME):
+            _save_vectorstore(vectorstore, index_path)
+            _write_manifest(index_path, new_manifest)
+            _cache_vectorstore(index_path, vectorstore)
+    
+    logger.info(f"Embedded {documents_count} documents ({len(splits)} chunks) to {index_path}")
+    return {
+        "vectorstore": vectorstore,
+        "documents_count": documents_count,
+        "chunks_count": len(splits),
+        "files_count": len(files),
+        "up_to_date": False,
+    }
+
+
+# =============================================================================
+# Shared OpenAI Clients
+# =============================================================================
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Chunks sent per embeddings request. OpenAI caps a request at 2048 inputs and
+# 300k tokens; at CHUNK_SIZE_TOKENS per chunk, 256 stays under both.
+EMBEDDING_BATCH_SIZE = 256
+
+_openai_http_client: Optional[httpx.Client] = None
+
+
+def get_openai_http_client() -> httpx.Client:
+    """
+    Get the process-wide HTTP client for OpenAI embedding calls.
+    
+    Sharing one keep-alive (HTTP/2) client means repeated queries reuse an open
+    connection instead of paying a new TLS handshake each time.
+    """
+    global _openai_http_client
+    if _openai_http_client is None:
+        _openai_http_client = httpx.Client(
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+    return _openai_http_client
+
+
+@functools.lru_cache(maxsize=32)
+def get_chat_model(model: str, temperature: float, api_key: str) -> ChatOpenAI:
+    """Get a cached ChatOpenAI client for the given model, temperature and key."""
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        openai_api_key=api_key,
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def get_embeddings(api_key: str, model: str = EMBEDDING_MODEL) -> OpenAIEmbeddings:
+    """Get a cached OpenAIEmbeddings client for the given key and model."""
+    return OpenAIEmbeddings(
+        model=model,
+        openai_api_key=api_key,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        http_client=get_openai_http_client(),
+    )
+
+
+# =============================================================================
+# Query Embedding Cache
+# =============================================================================
+
+QUERY_CACHE_FILENAME = "query_cache.npz"
+QUERY_CACHE_MAX_ENTRIES = 1024
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by SHA-256(model, query).
+    
+    Repeated questions skip the embeddings API round trip. Vectors are kept as
+    read-only float32 arrays. Entries are saved to an .npz file at interpreter
+    exit and reloaded on the next start; worker processes sharing the file
+    merge their entries into it rather than overwrite each other's.
+    """
+    
+    def __init__(self, path: Optional[Path] = None, max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+    
+    @staticmethod
+    def _key(query: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{query}".encode("utf-8")).hexdigest()
+    
+    def get_or_compute(self, query: str, model: str, compute) -> "np.ndarray":
+        """Return the cached embedding for a query, calling `compute()` on a miss."""
+        key = self._key(query, model)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                return vector
+        
+        vector = np.asarray(compute(), dtype=np.float32)
+        vector.flags.writeable = False
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+    
+    def _read_saved(self) -> "OrderedDict[str, np.ndarray]":
+        """Read the entries saved at `self.path`, oldest first."""
+        entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        if not self.path or not self.path.exists():
+            return entries
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"].astype(np.float32, copy=False)
+                vectors.flags.writeable = False
+                for key, vector in zip(data["keys"], vectors):
+                    entries[str(key)] = vector
+        except Exception as e:
+            logger.warning("Failed to load query embedding cache from %s: %s", self.path, e)
+        return entries
+    
+    def _load(self) -> None:
+        self._entries.update(self._read_saved())
+    
+    def save(self) -> None:
+        """Merge the cache into the file on disk (no-op when empty or no path is set)."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._entries:
+                return
+            ours = list(self._entries.items())
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Other workers save to the same file; merge under a lock so none
+            # of their entries are lost, with ours as the most recent
+            with _file_lock(self.path.with_name(f"{self.path.name}.lock")):
+                entries = self._read_saved()
+                for key, vector in ours:
+                    entries[key] = vector
+                    entries.move_to_end(key)
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+                # Write a temporary file and swap it in, so a crash mid-write
+                # never leaves a truncated cache behind
+                tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, keys=np.array(list(entries.keys())), vectors=np.stack(list(entries.values())))
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning("Failed to save query embedding cache to %s: %s", self.path, e)
+
+
+# Singleton instance
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+_query_embedding_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Get or create the shared query embedding cache (requires _ensure_faiss())."""
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        # RAG nodes run in worker threads; build (and register) only one cache
+        with _query_embedding_cache_lock:
+            if _query_embedding_cache is None:
+                index_base = get_env_config().rag_faiss_index_path
+                cache = QueryEmbeddingCache(Path(index_base) / QUERY_CACHE_FILENAME)
+                atexit.register(cache.save)
+                _query_embedding_cache = cache
+    return _query_embedding_cache
+
+
+def embed_query_cached(query: str, embeddings) -> "np.ndarray":
+    """Embed a search query, reusing a cached vector for repeated queries."""
+    return get_query_embedding_cache().get_or_compute(
+        query,
+        getattr(embeddings, "model", EMBEDDING_MODEL),
+        lambda: embeddings.embed_query(query),
+    )
+
+
 # =============================================================================
 # Document Embedding Service
 # =============================================================================
@@ -163,13 +1446,13 @@ def load_documents_from_directory(directory_path: str) -> List:
 class DocumentEmbeddingService:
     """Service for embedding documents into FAISS vector store."""
     
-    def __init__(self):
+    def __init__(self, mmap: bool = True):
         self.embeddings = None
-        if os.getenv("OPENAI_API_KEY"):
-            self.embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-                openai_api_key=os.getenv("OPENAI_API_KEY")
-            )
+        # Memory-map indexes opened for queries
+        self.mmap = mmap
+        api_key = get_env_config().openai_api_key
+        if api_key:
+            self.embeddings = get_embeddings(api_key)
     
     def embed_documents(
         self,
@@ -188,40 +1471,24 @@ class DocumentEmbeddingService:
         Returns:
             Dict with status and number of documents embedded
         """
-        if not FAISS_AVAILABLE:
+        if not _ensure_faiss():
             return {"success": False, "error": "FAISS not available"}
         
         if not self.embeddings:
             return {"success": False, "error": "OpenAI API key not configured"}
         
         try:
-            # Load documents
-            documents = load_documents_from_directory(documents_path)
-            if not documents:
-                return {"success": False, "error": f"No documents found at {documents_path}"}
-            
-            # Split documents
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-            )
-            splits = text_splitter.split_documents(documents)
-            
-            # Create FAISS index
-            vectorstore = FAISS.from_documents(splits, self.embeddings)
-            
-            # Save index
-            index_base = os.getenv("FAISS_INDEX_PATH", "./faiss_indexes")
+            index_base = get_env_config().faiss_index_path
             index_path = Path(index_base) / user_id / project_id
-            index_path.mkdir(parents=True, exist_ok=True)
-            vectorstore.save_local(str(index_path))
             
-            logger.info(f"Embedded {len(documents)} documents ({len(splits)} chunks) to {index_path}")
+            result = sync_vectorstore(Path(documents_path), index_path, self.embeddings)
+            if not result["files_count"] or (result["vectorstore"] is None and not result["up_to_date"]):
+                return {"success": False, "error": f"No documents found at {documents_path}"}
             
             return {
                 "success": True,
-                "documents_count": len(documents),
-                "chunks_count": len(splits),
+                "documents_count": result["documents_count"],
+                "chunks_count": result["chunks_count"],
                 "index_path": str(index_path),
             }
             
@@ -246,9 +1513,9 @@ class DocumentEmbeddingService:
             top_k: Number of results to return
             
         Returns:
-            Dict with results and scores
+            Dict with results and cosine similarity scores (higher is better)
         """
-        if not FAISS_AVAILABLE:
+        if not _ensure_faiss():
             return {"success": False, "error": "FAISS not available"}
         
         if not self.embeddings:
@@ -256,28 +1523,24 @@ class DocumentEmbeddingService:
         
         try:
             # Load index
-            index_base = os.getenv("FAISS_INDEX_PATH", "./faiss_indexes")
+            index_base = get_env_config().faiss_index_path
             index_path = Path(index_base) / user_id / project_id
             
             if not (index_path / "index.faiss").exists():
                 return {"success": False, "error": "Index not found. Please embed documents first."}
             
-            vectorstore = FAISS.load_local(
-                str(index_path),
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+            vectorstore = load_vectorstore(str(index_path), self.embeddings, mmap=self.mmap)
             
             # Query
-            docs_and_scores = vectorstore.similarity_search_with_score(query, k=top_k)
-            
-            results = []
-            for doc, score in docs_and_scores:
-                results.append({
+            query_vector = embed_query_cached(query, self.embeddings)
+            results = [
+                {
                     "content": doc.page_content,
                     "source": doc.metadata.get("source", "Unknown"),
-                    "score": float(score),
-                })
+                    "score": score,
+                }
+                for doc, score in search_vectorstore(vectorstore, query_vector, top_k)
+            ]
             
             return {"success": True, "results": results}
             
@@ -288,12 +1551,13 @@ class DocumentEmbeddingService:
     def delete_index(self, user_id: str, project_id: str) -> Dict[str, Any]:
         """Delete a FAISS index for a project."""
         try:
-            index_base = os.getenv("FAISS_INDEX_PATH", "./faiss_indexes")
+            index_base = get_env_config().faiss_index_path
             index_path = Path(index_base) / user_id / project_id
             
             if index_path.exists():
                 import shutil
                 shutil.rmtree(index_path)
+                evict_vectorstore(index_path)
                 return {"success": True, "message": f"Deleted index at {index_path}"}
             
             return {"success": True, "message": "Index did not exist"}
@@ -303,60 +1567,225 @@ class DocumentEmbeddingService:
             return {"success": False, "error": str(e)}
 
 
+# Singleton instance
+_embedding_service: Optional[DocumentEmbeddingService] = None
+
+
+def get_embedding_service() -> DocumentEmbeddingService:
+    """Get or create the shared DocumentEmbeddingService instance."""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = DocumentEmbeddingService()
+    return _embedding_service
+
+
+# =============================================================================
+# RAG Context Helpers
+# =============================================================================
+
+# Characters of each retrieved chunk included in a RAG node's context. Paired
+# with CHUNK_SIZE_TOKENS: cl100k averages about 4 characters per token in
+# English (fewer in Thai), so a whole chunk normally fits and the limit only
+# guards against unusually long ones. Change both together.
+RAG_SNIPPET_CHARS_PER_TOKEN = 4
+RAG_SNIPPET_CHARS = CHUNK_SIZE_TOKENS * RAG_SNIPPET_CHARS_PER_TOKEN
+
+# Minimum seconds between document checks for an already-built index on the
+# query path. Each check lists and stats the documents directory and reads the
+# manifest; /embed-documents still syncs immediately.
+RAG_SYNC_INTERVAL_SECONDS = 30
+
+# Index directory -> time.monotonic() of its last check on the query path
+_rag_sync_checked: Dict[str, float] = {}
+_rag_sync_checked_lock = threading.Lock()
+
+
+def _rag_sync_due(index_path: Path) -> bool:
+    """Whether the query path should check `index_path` for document changes now."""
+    key = os.path.abspath(index_path)
+    now = time.monotonic()
+    with _rag_sync_checked_lock:
+        last = _rag_sync_checked.get(key)
+        if last is not None and now - last < RAG_SYNC_INTERVAL_SECONDS:
+            return False
+        _rag_sync_checked[key] = now
+        return True
+
+
+def _rag_snippet(text: str) -> str:
+    """Cut a chunk to RAG_SNIPPET_CHARS, marking the cut with an ellipsis."""
+    # Slice one character past the limit so only the slice is measured, not the whole chunk
+    snippet = text[:RAG_SNIPPET_CHARS + 1]
+    return snippet[:RAG_SNIPPET_CHARS] + "..." if len(snippet) > RAG_SNIPPET_CHARS else snippet
+
+
+# =============================================================================
+# Google Sheets Helpers
+# =============================================================================
+
+# Service account key for Google Sheets nodes, in the ai_backend directory
+SHEETS_CREDENTIALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client_secret.json")
+
+# Scopes for the Google Sheets API (Drive is needed for last-modified times)
+SHEETS_SCOPES = (
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+)
+
+# Data rows included in a Google Sheets node's context
+SHEETS_PREVIEW_ROWS = 50
+
+# Formatted sheet contexts, keyed by (spreadsheet_id, sheet_name) and
+# tagged with the spreadsheet's last modification time
+SHEETS_CACHE_SIZE = 64
+_sheets_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_sheets_cache_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_gspread_client(credentials_file: str, credentials_mtime: int):
+    """
+    Get an authorized gspread client, shared across Google Sheets nodes.
+    
+    Keyed on the key file's mtime so replacing the file picks up the new
+    credentials; access tokens are refreshed by the session as they expire.
+    """
+    credentials = Credentials.from_service_account_file(credentials_file, scopes=list(SHEETS_SCOPES))
+    return gspread.Client(auth=credentials, session=AuthorizedSession(credentials))
+
+
+def _csv_table(headers: List, rows: List[List]) -> str:
+    """
+    Format rows as CSV for a prompt. CSV costs fewer tokens than a markdown
+    table and is written by the C csv module in one pass.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return buffer.getvalue().rstrip("\n")
+
+
+# =============================================================================
+# LLM Call Throttling
+# =============================================================================
+
+LLM_MAX_ATTEMPTS = 5
+
+# Bounds in-flight LLM requests across all concurrent workflow executions;
+# created on first use so the limit comes from get_env_config()
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(get_env_config().max_concurrent_llm_calls)
+    return _llm_semaphore
+
+
+async def astream_llm(
+    llm,
+    messages,
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """
+    Stream an LLM response and return the full text, bounded by the shared
+    semaphore and retried with exponential backoff when the provider
+    rate-limits us. Each chunk is passed to `on_token` as it arrives; once one
+    has been passed on, a rate-limit error is raised rather than retried, so
+    no text is sent twice.
+    """
+    emitted = False
+    
+    def retryable(exc: BaseException) -> bool:
+        return isinstance(exc, openai.RateLimitError) and not emitted
+    
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(retryable),
+        wait=wait_random_exponential(min=1, max=20),
+        stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+        reraise=True,
+    ):
+        with attempt:
+            async with _get_llm_semaphore():
+                parts = []
+                async for chunk in llm.astream(messages):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        if on_token:
+                            emitted = True
+                            await on_token(chunk.content)
+                return "".join(parts)
+
+
+# Message classes for conversation_history entries by role; other roles are skipped
+HISTORY_MESSAGE_TYPES = {"user": HumanMessage, "assistant": AIMessage}
+
+# Model and prompt used to condense conversation history older than the window
+HISTORY_SUMMARY_MODEL = "gpt-4o-mini"
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize the conversation below in a few sentences. Keep names, facts, "
+    "decisions and open questions the assistant may need later."
+)
+
+
 # =============================================================================
 # Node Processors
 # =============================================================================
 
 class NodeProcessors:
-    """Processors for different node types."""
+    """Processors for different node types.
+    
+    Each processor reads the current state and returns a partial state update.
+    """
     
     def __init__(self):
         self.llm = self._create_llm()
     
     def _create_llm(self):
         """Create the LLM based on available API keys."""
+        env = get_env_config()
+        
         # Try OpenAI first
-        if os.getenv("OPENAI_API_KEY"):
+        if env.openai_api_key:
             return ChatOpenAI(
                 model="gpt-4o-mini",
                 temperature=0.7,
             )
         
         # Try Together AI via LiteLLM
-        if os.getenv("TOGETHER_API_KEY"):
+        if env.together_api_key:
             return ChatOpenAI(
                 model="together_ai/Qwen/Qwen2.5-7B-Instruct-Turbo",
-                api_key=os.getenv("TOGETHER_API_KEY"),
+                api_key=env.together_api_key,
                 base_url="https://api.together.xyz/v1",
             )
         
         # Try OpenRouter
-        if os.getenv("OPENROUTER_API_KEY"):
+        if env.openrouter_api_key:
             return ChatOpenAI(
                 model="qwen/qwen-2.5-7b-instruct",
-                api_key=os.getenv("OPENROUTER_API_KEY"),
+                api_key=env.openrouter_api_key,
                 base_url="https://openrouter.ai/api/v1",
             )
         
         logger.warning("No API key found, using mock responses")
         return None
     
-    def process_text_input(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    def process_text_input(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process text-input node - captures user input."""
-        state["nodes_executed"].append("text-input")
-        # Initialize output_variables if not present
-        if "output_variables" not in state:
-            state["output_variables"] = {}
         # User message is already in state
-        return state
+        return {"nodes_executed": ["text-input"]}
     
-    def process_ai_model(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    async def process_ai_model(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process ai-model node - generates AI response with OpenAI."""
-        state["nodes_executed"].append("ai-model")
+        update: Dict[str, Any] = {"nodes_executed": ["ai-model"]}
         
-        # Initialize output_variables if not present
-        if "output_variables" not in state:
-            state["output_variables"] = {}
+        # Bind state fields used below once
+        user_message = state["user_message"]
+        rag_context = state["rag_context"]
+        sheets_data = state["sheets_data"]
         
         # Get configuration from node data
         model_name = node_data.get("modelName", "gpt-4o-mini")
@@ -367,16 +1796,13 @@ class NodeProcessors:
         output_variable_name = node_data.get("outputVariable", node_data.get("outputVariableName", ""))
         
         # Get API key: STRICTLY use user-provided key. Do NOT fall back to environment variable!
-        api_key = state.get("openai_api_key")
+        api_key = state["openai_api_key"]
         
         # Create LLM if key is provided
         llm = None
         if api_key:
-            llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                openai_api_key=api_key,
-            )
+            # Round so slider noise (0.7 vs 0.7000001) doesn't miss the client cache
+            llm = get_chat_model(model_name, round(float(temperature), 2), api_key)
         
         # Build system prompt with expected output format if specified
         full_system_prompt = system_prompt
@@ -386,29 +1812,32 @@ class NodeProcessors:
         # Build messages
         messages = [SystemMessage(content=full_system_prompt)]
         
-        # Add conversation history
-        for msg in state.get("conversation_history", []):
-            if msg.get("role") == "user":
-                messages.append(HumanMessage(content=msg.get("content", "")))
-            elif msg.get("role") == "assistant":
-                messages.append(AIMessage(content=msg.get("content", "")))
+        # Add conversation history, after the summary of older turns if any
+        if state["history_summary"]:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {state['history_summary']}"))
+        messages.extend(
+            message_cls(content=msg.get("content", ""))
+            for msg in state["conversation_history"]
+            if (message_cls := HISTORY_MESSAGE_TYPES.get(msg.get("role"))) is not None
+        )
         
         # Add RAG context if available
         context_parts = []
-        if state.get("rag_context"):
-            context_parts.append(f"Relevant context from documents:\n{state['rag_context']}")
-        if state.get("sheets_data"):
-            context_parts.append(f"Data from spreadsheet:\n{state['sheets_data']}")
+        if rag_context:
+            context_parts.append(f"Relevant context from documents:\n{rag_context}")
+        if sheets_data:
+            context_parts.append(f"Data from spreadsheet:\n{sheets_data}")
         
         # Add current message with context
-        user_content = state["user_message"]
         if context_parts:
-            user_content = f"{chr(10).join(context_parts)}\n\nUser query: {user_content}"
+            user_content = "\n".join(context_parts) + f"\n\nUser query: {user_message}"
+        else:
+            user_content = user_message
         
         # Debug: log whether rag context is present and a short preview
         try:
-            rag_present = bool(state.get("rag_context"))
-            rag_preview = (state.get("rag_context") or "").replace("\n", " ")[:400]
+            rag_present = bool(rag_context)
+            rag_preview = (rag_context or "").replace("\n", " ")[:400]
             user_preview = user_content.replace("\n", " ")[:400]
             logger.info("AI Model call: rag_present=%s, rag_preview=%s", rag_present, rag_preview)
             logger.debug("AI Model final user_content (truncated): %s", user_preview)
@@ -420,46 +1849,49 @@ class NodeProcessors:
         # Generate response
         if llm:
             try:
-                response = llm.invoke(messages)
-                state["response"] = response.content
-                state["model_used"] = model_name
+                on_token = state["on_token"] if node_data["id"] in state["stream_node_ids"] else None
+                response_text = await astream_llm(llm, messages, on_token)
+                update["response"] = response_text
+                update["model_used"] = model_name
                 
                 # Store output in variable if name specified (for use in conditions)
                 if output_variable_name:
-                    state["output_variables"][output_variable_name] = response.content
+                    update["output_variables"] = {output_variable_name: response_text}
                     logger.info(f"Stored AI output in variable '{output_variable_name}'")
                     
             except Exception as e:
                 logger.exception("LLM error")
-                state["response"] = f"Error generating response: {str(e)}"
+                update["response"] = f"Error generating response: {str(e)}"
         else:
             # Mock response for demo when no key is provided
-            state["response"] = f"[Demo Mode - No OpenAI API Key configured in Settings] Message received: {state['user_message']}"
-            state["model_used"] = "none (mock)"
+            update["response"] = f"[Demo Mode - No OpenAI API Key configured in Settings] Message received: {user_message}"
+            update["model_used"] = "none (mock)"
             if output_variable_name:
-                state["output_variables"][output_variable_name] = state["response"]
+                update["output_variables"] = {output_variable_name: update["response"]}
         
-        return state
+        return update
     
-    def process_rag_documents(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    def process_rag_documents(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process rag-documents node - retrieves relevant context using FAISS + OpenAI."""
-        state["nodes_executed"].append("rag-documents")
+        rag_debug: Dict[str, Any] = {}
+        update: Dict[str, Any] = {"nodes_executed": ["rag-documents"], "rag_debug": rag_debug}
 
-        if not FAISS_AVAILABLE:
-            state["rag_context"] = "[FAISS not installed] Install faiss-cpu and langchain-community."
-            return state
+        if not _ensure_faiss():
+            update["rag_context"] = "[FAISS not installed] Install faiss-cpu and langchain-community."
+            return update
 
         # Get API key: STRICTLY use user-provided key.
-        api_key = state.get("openai_api_key")
+        api_key = state["openai_api_key"]
 
         if not api_key:
-            state["rag_context"] = "[OpenAI API key required for embeddings - Configure in Settings]"
-            return state
+            update["rag_context"] = "[OpenAI API key required for embeddings - Configure in Settings]"
+            return update
 
         try:
             # Resolve documents path
             # Priority: node data -> ENV DOCUMENTS_STORAGE_PATH -> ../backend/uploads/documents (relative to this file)
-            base_documents_dir = Path(os.getenv("DOCUMENTS_STORAGE_PATH", "")).resolve() if os.getenv("DOCUMENTS_STORAGE_PATH") else (Path(__file__).resolve().parent.parent / "backend" / "uploads" / "documents")
+            env = get_env_config()
+            base_documents_dir = env.documents_storage_path
             project_id = node_data.get("projectId", "")
             user_id = node_data.get("userId", "")
             top_k = node_data.get("topK", 3)
@@ -478,30 +1910,17 @@ class NodeProcessors:
             else:
                 documents_path = str(base_documents_dir)
             
-            # Build index path. Prefer per-user/per-project index when both user_id and project_id present.
-            index_base = os.getenv("FAISS_INDEX_PATH", str(Path(__file__).resolve().parent / "faiss_indexes"))
-            if project_id:
-                if user_id:
-                    index_persist_dir = os.path.join(index_base, user_id, project_id)
-                else:
-                    # Fallback to project-only index path if user_id is not provided
-                    index_persist_dir = os.path.join(index_base, project_id)
-            else:
-                index_persist_dir = os.path.join(index_base, "default")
+            index_base = env.rag_faiss_index_path
 
             # Get user query
             query = state["user_message"]
 
             # Initialize OpenAI embeddings with user key
-            embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-                openai_api_key=api_key
-            )
+            embeddings = get_embeddings(api_key)
 
             # Try to load existing FAISS index. Support multiple possible index layouts
             # Candidate order: (1) index_base/user_id/project_id, (2) index_base/project_id, (3) index_base/project_id (legacy)
             vectorstore = None
-            state.setdefault("rag_debug", {})
             tried_index_paths = []
 
             candidates = []
@@ -516,155 +1935,164 @@ class NodeProcessors:
 
             # Try each candidate until we find an index.faiss
             index_loaded = False
-            for cand in candidates:
+            loaded_path = None
+            for cand, exists in zip(candidates, probe_index_paths(candidates)):
                 cand_path = Path(cand)
-                tried_index_paths.append(str(cand_path))
-                cand_index_file = cand_path / "index.faiss"
-                exists = cand_path.exists() and cand_index_file.exists()
-                state["rag_debug"].setdefault("index_candidates", [])
-                state["rag_debug"]["index_candidates"].append({"path": str(cand_path), "exists": exists})
+                tried_index_paths.append(cand)
+                rag_debug.setdefault("index_candidates", []).append({"path": cand, "exists": exists})
                 if exists:
                     try:
-                        vectorstore = FAISS.load_local(str(cand_path), embeddings, allow_dangerous_deserialization=True)
+                        vectorstore = load_vectorstore(str(cand_path), embeddings, mmap=True)
                         logger.info("Loaded existing FAISS index from %s", cand_path)
                         index_loaded = True
-                        state["rag_debug"]["index_loaded_from"] = str(cand_path)
+                        loaded_path = cand_path
+                        rag_debug["index_loaded_from"] = str(cand_path)
                         break
                     except Exception as e:
                         logger.warning("Failed to load FAISS index at %s: %s", cand_path, e)
-                        state["rag_debug"].setdefault("index_load_errors", []).append({"path": str(cand_path), "error": str(e)})
+                        rag_debug.setdefault("index_load_errors", []).append({"path": str(cand_path), "error": str(e)})
 
             # Record what we tried
-            state["rag_debug"]["index_paths_tried"] = tried_index_paths
-            state["rag_debug"]["index_exists_any"] = index_loaded
-            state["rag_debug"]["user_id"] = user_id
-            state["rag_debug"]["project_id"] = project_id
-            state["rag_debug"]["documents_path"] = documents_path
+            rag_debug["index_paths_tried"] = tried_index_paths
+            rag_debug["index_exists_any"] = index_loaded
+            rag_debug["user_id"] = user_id
+            rag_debug["project_id"] = project_id
+            rag_debug["documents_path"] = documents_path
             logger.info("RAG: user_id=%s project_id=%s | index_candidates=%s | loaded=%s | documents_path=%s", user_id, project_id, tried_index_paths, index_loaded, documents_path)
 
+            # Create the index, or incrementally pick up added/changed/removed documents.
+            # Only the preferred index (first candidate) is synced; fallback indexes and
+            # indexes created before manifest tracking are used as they are. With an
+            # index already loaded, check at most every RAG_SYNC_INTERVAL_SECONDS
+            # and don't wait on a sync another worker is running.
+            docs_path = Path(documents_path)
+            index_path = Path(candidates[0])
+            if (
+                docs_path.exists()
+                and (loaded_path is None or loaded_path == index_path)
+                and (vectorstore is None or _rag_sync_due(index_path))
+            ):
+                sync = sync_vectorstore(
+                    docs_path,
+                    index_path,
+                    embeddings,
+                    vectorstore=vectorstore,
+                    rebuild_untracked=False,
+                    wait=vectorstore is None,
+                )
+                if sync["vectorstore"] is not None:
+                    vectorstore = sync["vectorstore"]
+                if not sync["up_to_date"] and vectorstore is not None:
+                    logger.info(
+                        "RAG index %s at %s: documents_embedded=%s chunks=%s",
+                        "updated" if index_loaded else "created", index_path,
+                        sync["documents_count"], sync["chunks_count"],
+                    )
+                    rag_debug["index_created"] = not index_loaded
+                    rag_debug["index_updated"] = index_loaded
+                    rag_debug["documents_found"] = sync["documents_count"]
+                    rag_debug["chunks_count"] = sync["chunks_count"]
+
             if vectorstore is None:
-                # Try to create index from documents
-                docs_path = Path(documents_path)
                 if docs_path.exists():
-                    documents = load_documents_from_directory(str(docs_path))
-                    state["rag_debug"]["documents_found"] = len(documents)
-                    logger.info("RAG embedding: documents_found=%s at %s", len(documents), docs_path)
-                    if documents:
-                        # Split documents
-                        text_splitter = RecursiveCharacterTextSplitter(
-                            chunk_size=1000,
-                            chunk_overlap=200,
-                        )
-                        splits = text_splitter.split_documents(documents)
-
-                        # Create FAISS index
-                        vectorstore = FAISS.from_documents(splits, embeddings)
-
-                        # Save for future use
-                        # Save to the preferred candidate (first in our candidates list)
-                        try:
-                            index_path = Path(candidates[0]) if candidates else Path(index_base) / "default"
-                        except Exception:
-                            index_path = Path(index_base) / "default"
-                        index_path.mkdir(parents=True, exist_ok=True)
-                        vectorstore.save_local(str(index_path))
-                        logger.info(f"Created and saved FAISS index to {index_path}")
-                        state["rag_debug"]["index_created"] = True
-                        state["rag_debug"]["chunks_count"] = len(splits)
-                    else:
-                            # No documents to embed - record debug and avoid injecting error text
-                            state.setdefault("rag_debug", {})
-                            state["rag_debug"]["error"] = "no_documents_found"
-                            state["rag_debug"]["error_message"] = f"No documents found at {documents_path}"
-                            state["rag_debug"]["index_created"] = False
-                            logger.warning("No documents found at %s", documents_path)
-                            state["rag_context"] = None
-                            return state
+                    # No documents to embed - record debug and avoid injecting error text
+                    rag_debug["error"] = "no_documents_found"
+                    rag_debug["error_message"] = f"No documents found at {documents_path}"
+                    rag_debug["index_created"] = False
+                    logger.warning("No documents found at %s", documents_path)
                 else:
-                        # Record error in debug but do not inject error text into rag_context
-                        state.setdefault("rag_debug", {})
-                        state["rag_debug"]["error"] = "documents_directory_not_found"
-                        state["rag_debug"]["error_message"] = f"Documents directory not found: {documents_path}"
-                        logger.warning("Documents directory not found: %s", documents_path)
-                        # Leave rag_context as None so AI model won't receive an error string as context
-                        state["rag_context"] = None
-                        return state
+                    # Record error in debug but do not inject error text into rag_context
+                    rag_debug["error"] = "documents_directory_not_found"
+                    rag_debug["error_message"] = f"Documents directory not found: {documents_path}"
+                    logger.warning("Documents directory not found: %s", documents_path)
+                # Leave rag_context as None so AI model won't receive an error string as context
+                update["rag_context"] = None
+                return update
 
             # Query the vector store
-            docs_and_scores = vectorstore.similarity_search_with_score(query, k=top_k)
-            state["rag_debug"]["results_requested"] = top_k
+            query_vector = embed_query_cached(query, embeddings)
+            docs_and_scores = search_vectorstore(vectorstore, query_vector, top_k)
+            rag_debug["results_requested"] = top_k
 
             # Format context
-            context_parts = []
-            for i, (doc, score) in enumerate(docs_and_scores, 1):
-                text = doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content
-                source = doc.metadata.get("source", "Unknown")
-                context_parts.append(f"[Source {i}: {Path(source).name} (score: {score:.3f})]\n{text}")
+            context_parts = [
+                f"[Source {i}: {os.path.basename(doc.metadata.get('source', 'Unknown'))} (score: {score:.3f})]\n"
+                f"{_rag_snippet(doc.page_content)}"
+                for i, (doc, score) in enumerate(docs_and_scores, 1)
+            ]
 
             if context_parts:
-                state["rag_context"] = "\n\n".join(context_parts)
-                state["rag_debug"]["results_count"] = len(context_parts)
+                update["rag_context"] = "\n\n".join(context_parts)
+                rag_debug["results_count"] = len(context_parts)
                 # Log a short preview of the retrieved context
                 try:
-                    preview = state["rag_context"].replace("\n", " ")[:800]
+                    preview = update["rag_context"].replace("\n", " ")[:800]
                     logger.info("RAG provided context: results_count=%s preview=%s", len(context_parts), preview)
                 except Exception:
                     logger.exception("Error logging RAG context preview")
             else:
                     # No relevant documents found - don't set an error string into rag_context
-                    state["rag_debug"]["results_count"] = 0
-                    state["rag_debug"]["note"] = "no_relevant_documents"
-                    state["rag_context"] = None
+                    rag_debug["results_count"] = 0
+                    rag_debug["note"] = "no_relevant_documents"
+                    update["rag_context"] = None
 
         except Exception as e:
             logger.exception("Error in RAG processing")
-            state["rag_context"] = f"[RAG Error: {str(e)}]"
+            update["rag_context"] = f"[RAG Error: {str(e)}]"
 
-        return state
+        return update
     
-    def process_google_sheets(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    def process_google_sheets(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process google-sheets node - fetches data from sheets using gspread."""
-        state["nodes_executed"].append("google-sheets")
+        update: Dict[str, Any] = {"nodes_executed": ["google-sheets"]}
         
         spreadsheet_id = node_data.get("spreadsheetId", "")
         sheet_name = node_data.get("sheetName", "Sheet1")
         
-        if not GSPREAD_AVAILABLE:
+        if not _ensure_gspread():
             logger.warning("gspread not available, returning mock data")
-            state["sheets_data"] = f"[Google Sheets not available] Could not fetch data from {sheet_name}"
-            return state
+            update["sheets_data"] = f"[Google Sheets not available] Could not fetch data from {sheet_name}"
+            return update
         
         if not spreadsheet_id:
             logger.warning("No spreadsheet ID provided")
-            state["sheets_data"] = "[Error] No spreadsheet ID configured"
-            return state
+            update["sheets_data"] = "[Error] No spreadsheet ID configured"
+            return update
         
         try:
-            # Define the scope for Google Sheets API
-            scope = [
-                'https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive'
-            ]
-            
-            # Look for credentials file in the ai_backend directory
-            credentials_file = os.path.join(os.path.dirname(__file__), 'client_secret.json')
-            
-            if not os.path.exists(credentials_file):
-                logger.warning(f"Credentials file not found at {credentials_file}")
-                state["sheets_data"] = "[Error] Google Sheets credentials not configured"
-                return state
+            try:
+                credentials_mtime = os.stat(SHEETS_CREDENTIALS_FILE).st_mtime_ns
+            except FileNotFoundError:
+                logger.warning(f"Credentials file not found at {SHEETS_CREDENTIALS_FILE}")
+                update["sheets_data"] = "[Error] Google Sheets credentials not configured"
+                return update
             
-            # Authorize and create client
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
-            client = gspread.authorize(credentials)
+            client = _get_gspread_client(SHEETS_CREDENTIALS_FILE, credentials_mtime)
             
             # Open spreadsheet by ID
             try:
                 spreadsheet = client.open_by_key(spreadsheet_id)
             except gspread.SpreadsheetNotFound:
                 logger.warning(f"Spreadsheet not found: {spreadsheet_id}")
-                state["sheets_data"] = f"[Error] Spreadsheet not found. Make sure it's shared with the service account."
-                return state
+                update["sheets_data"] = f"[Error] Spreadsheet not found. Make sure it's shared with the service account."
+                return update
+            
+            # Reuse the formatted context while the spreadsheet is unmodified. The
+            # modified time comes from the Drive API, which the service account
+            # may not have access to; then always fetch and don't cache.
+            cache_key = (spreadsheet_id, sheet_name)
+            try:
+                etag = spreadsheet.get_lastUpdateTime()
+            except Exception as e:
+                logger.warning(f"Could not read modified time of spreadsheet {spreadsheet_id}, not caching: {e}")
+                etag = None
+            if etag is not None:
+                with _sheets_cache_lock:
+                    cached = _sheets_cache.get(cache_key)
+                    if cached and cached[0] == etag:
+                        _sheets_cache.move_to_end(cache_key)
+                        update["sheets_data"] = cached[1]
+                        return update
             
             # Get the specific worksheet
             try:
@@ -675,105 +2103,79 @@ class NodeProcessors:
                 worksheet = spreadsheet.sheet1
                 logger.info(f"Using first sheet: {worksheet.title}")
             
-            # Get all records as a list of dictionaries
-            records = worksheet.get_all_records()
+            # One values.batchGet call for the sheet's used range. A range naming
+            # only the sheet covers every row with data in any column, so rows
+            # whose first column is blank are counted too.
+            title = worksheet.title.replace("'", "''")
+            response = spreadsheet.values_batch_get([f"'{title}'"])
+            values = response.get("valueRanges", [{}])[0].get("values", [])
             
-            if not records:
-                # Try getting all values if no headers
-                all_values = worksheet.get_all_values()
-                if all_values:
-                    # Convert to markdown table format
-                    headers = all_values[0] if all_values else []
-                    rows = all_values[1:] if len(all_values) > 1 else []
-                    
-                    if headers and rows:
-                        # Create markdown table
-                        df = pd.DataFrame(rows, columns=headers)
-                        sheets_context = f"Data from Google Sheet '{sheet_name}':\n\n{df.to_markdown(index=False)}"
-                    else:
-                        sheets_context = f"Google Sheet '{sheet_name}' appears to be empty."
-                else:
-                    sheets_context = f"Google Sheet '{sheet_name}' is empty."
+            headers = values[0] if values else []
+            total_rows = max(len(values) - 1, 0)
+            # The API trims trailing empty cells; pad rows to the header width
+            rows = [row + [""] * (len(headers) - len(row)) for row in values[1:SHEETS_PREVIEW_ROWS + 1]]
+            
+            if not values:
+                sheets_context = f"Google Sheet '{sheet_name}' is empty."
+            elif not rows:
+                sheets_context = f"Google Sheet '{sheet_name}' appears to be empty."
+            elif total_rows > SHEETS_PREVIEW_ROWS:
+                # Limit to the preview rows for context (to avoid token limits)
+                sheets_context = f"Data from Google Sheet '{sheet_name}' as CSV (showing first {SHEETS_PREVIEW_ROWS} of {total_rows} rows):\n\n{_csv_table(headers, rows)}"
             else:
-                # Convert records to DataFrame and then to markdown
-                df = pd.DataFrame(records)
-                
-                # Limit to first 50 rows for context (to avoid token limits)
-                if len(df) > 50:
-                    df_preview = df.head(50)
-                    sheets_context = f"Data from Google Sheet '{sheet_name}' (showing first 50 of {len(df)} rows):\n\n{df_preview.to_markdown(index=False)}"
-                else:
-                    sheets_context = f"Data from Google Sheet '{sheet_name}' ({len(df)} rows):\n\n{df.to_markdown(index=False)}"
+                sheets_context = f"Data from Google Sheet '{sheet_name}' as CSV ({total_rows} rows):\n\n{_csv_table(headers, rows)}"
             
-            logger.info(f"Successfully fetched data from sheet '{sheet_name}': {len(records)} records")
-            state["sheets_data"] = sheets_context
+            logger.info(f"Successfully fetched data from sheet '{sheet_name}': {total_rows} records")
+            update["sheets_data"] = sheets_context
+            if etag is not None:
+                with _sheets_cache_lock:
+                    _sheets_cache[cache_key] = (etag, sheets_context)
+                    _sheets_cache.move_to_end(cache_key)
+                    while len(_sheets_cache) > SHEETS_CACHE_SIZE:
+                        _sheets_cache.popitem(last=False)
             
         except Exception as e:
             logger.error(f"Error fetching Google Sheets data: {str(e)}")
-            state["sheets_data"] = f"[Error] Failed to fetch data from Google Sheets: {str(e)}"
+            update["sheets_data"] = f"[Error] Failed to fetch data from Google Sheets: {str(e)}"
         
-        return state
+        return update
     
-    def process_if_condition(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    def process_if_condition(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process if-condition node - evaluates condition against message or output variables."""
-        state["nodes_executed"].append("if-condition")
-        
         condition_type = node_data.get("conditionType", "contains")
         field = node_data.get("field", "response")  # Can be "message", "response", or a variable name
         # Frontend sends conditionValue, but also check for value as fallback
         value = node_data.get("conditionValue", node_data.get("value", ""))
         
         # Get the field to check - supports checking output variables
-        check_value = ""
         if field == "message":
-            check_value = state.get("user_message", "")
+            check_value = state["user_message"]
         elif field == "response":
-            check_value = state.get("response", "")
-        elif field in state.get("output_variables", {}):
-            # Check output variable by name
-            check_value = state["output_variables"].get(field, "")
+            check_value = state["response"]
         else:
-            # Try to find in output_variables as fallback
-            check_value = state.get("output_variables", {}).get(field, state.get("response", ""))
+            # Check output variable by name, falling back to the response
+            check_value = state["output_variables"].get(field)
+            if check_value is None:
+                check_value = state["response"]
         
         # Truncate for logging
         log_check_value = check_value[:50] + "..." if len(check_value) > 50 else check_value
         logger.info(f"If-condition checking '{field}' ({condition_type}) against '{value}': check_value='{log_check_value}'")
         
-        # Evaluate condition
-        result = False
-        if condition_type == "contains":
-            result = value.lower() in check_value.lower() if value else False
-        elif condition_type == "equals":
-            result = check_value.lower().strip() == value.lower().strip()
-        elif condition_type == "startsWith":
-            result = check_value.lower().strip().startswith(value.lower().strip()) if value else False
-        elif condition_type == "endsWith":
-            result = check_value.lower().strip().endswith(value.lower().strip()) if value else False
-        elif condition_type == "regex":
-            import re
-            try:
-                result = bool(re.search(value, check_value, re.IGNORECASE)) if value else False
-            except:
-                result = False
-        elif condition_type == "isYes":
-            # Check if response is affirmative
-            affirmatives = ["yes", "y", "true", "1", "correct", "affirmative", "yeah", "yep"]
-            result = check_value.lower().strip() in affirmatives
-        elif condition_type == "isNo":
-            # Check if response is negative
-            negatives = ["no", "n", "false", "0", "incorrect", "negative", "nope", "nah"]
-            result = check_value.lower().strip() in negatives
+        # Evaluate condition; unknown condition types are false
+        operator_fn = CONDITION_OPERATORS.get(condition_type)
+        result = operator_fn(check_value, value or "") if operator_fn else False
         
         logger.info(f"If-condition result: {result}")
-        state["condition_results"][node_data.get("id", "condition")] = result
-        return state
+        return {
+            "nodes_executed": ["if-condition"],
+            "condition_results": {node_data.get("id", "condition"): result},
+        }
     
-    def process_text_output(self, state: WorkflowState, node_data: Dict) -> WorkflowState:
+    def process_text_output(self, state: WorkflowState, node_data: Dict) -> Dict[str, Any]:
         """Process text-output node - formats final output."""
-        state["nodes_executed"].append("text-output")
         # Response is already in state from AI model
-        return state
+        return {"nodes_executed": ["text-output"]}
 
 
 # =============================================================================
@@ -783,8 +2185,58 @@ class NodeProcessors:
 class WorkflowExecutor:
     """Executes workflow configurations using LangGraph."""
     
+    # Max compiled graphs kept in memory (least recently used are evicted)
+    COMPILED_CACHE_SIZE = 128
+    # Max sessions whose history summary is kept in memory
+    HISTORY_SUMMARY_CACHE_SIZE = 256
+    
     def __init__(self):
         self.processors = NodeProcessors()
+        self._compiled_cache: "OrderedDict[str, Any]" = OrderedDict()
+        # session_id -> (number of messages summarized, their digest, summary)
+        self._history_summaries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Processor for each node type, built once
+        self._processors_by_type: Dict[str, Callable] = {
+            "text-input": self.processors.process_text_input,
+            "ai-model": self.processors.process_ai_model,
+            "rag-documents": self.processors.process_rag_documents,
+            "google-sheets": self.processors.process_google_sheets,
+            "if-condition": self.processors.process_if_condition,
+            "text-output": self.processors.process_text_output,
+            "voice-input": self.processors.process_text_input,  # Same as text for now
+            "voice-output": self.processors.process_text_output,  # Same as text for now
+        }
+    
+    @staticmethod
+    def _workflow_cache_key(workflow) -> str:
+        """
+        Stable hash of the workflow topology: node ids and types, and
+        connections. Node data is passed in per run (see _run_node()), so a
+        workflow whose settings change but whose shape doesn't reuses its graph.
+        """
+        payload = orjson.dumps(
+            [
+                [(n.id, n.type) for n in workflow.nodes],
+                [(c.sourceNodeId, c.sourcePortId, c.targetNodeId, c.targetPortId) for c in workflow.connections],
+            ],
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            default=str,
+        )
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _get_compiled_graph(self, workflow):
+        """Return the compiled graph for a workflow, building it on a cache miss."""
+        key = self._workflow_cache_key(workflow)
+        compiled = self._compiled_cache.get(key)
+        if compiled is not None:
+            self._compiled_cache.move_to_end(key)
+            return compiled
+        
+        compiled = self._build_graph(workflow).compile()
+        self._compiled_cache[key] = compiled
+        if len(self._compiled_cache) > self.COMPILED_CACHE_SIZE:
+            self._compiled_cache.popitem(last=False)
+        return compiled
     
     def _build_graph(self, workflow) -> StateGraph:
         """Build a LangGraph from workflow configuration.
@@ -794,210 +2246,247 @@ class WorkflowExecutor:
         - When RAG connects to AI model's context port, RAG runs first
         - RAG populates state["rag_context"] which AI model consumes
         
-        IMPORTANT: LangGraph requires sequential execution - no parallel branches
-        that write to the same state keys. We must build a linear chain.
+        Context providers (RAG, Sheets) feeding the same AI model run in
+        parallel: the input node fans out to each of them and they fan in at
+        the AI model. They write different state keys, and shared keys
+        (nodes_executed, rag_debug) have reducers, so concurrent updates merge.
         """
         
         # Create state graph
         graph = StateGraph(WorkflowState)
         
-        # Parse nodes and connections
-        nodes = {n.id: n for n in workflow.nodes}
+        # Parse nodes and connections. Node ids are interned to integer indices:
+        # the structures below are lists indexed by node and sets of ints, and
+        # string ids are only looked up for LangGraph calls and logging.
+        nodes = list({n.id: n for n in workflow.nodes}.values())
+        ix2id = [n.id for n in nodes]
+        id2ix = {nid: ix for ix, nid in enumerate(ix2id)}
         connections = workflow.connections
         
-        # Build adjacency list with port info
-        # Structure: {source_id: [(target_id, source_port_id, target_port_id), ...]}
-        adjacency: Dict[str, List[tuple]] = {n.id: [] for n in workflow.nodes}
-        incoming: Dict[str, List[tuple]] = {n.id: [] for n in workflow.nodes}
+        # Build adjacency and incoming lists in a single pass over connections.
+        # The source port is classified once as a true/false branch (used by
+        # if-condition routing) instead of keeping the raw port string.
+        # Structure: adjacency[source_ix] = [(target_ix, is_true, is_false, target_port_id), ...]
+        adjacency: List[List[tuple]] = [[] for _ in nodes]
+        incoming: List[List[tuple]] = [[] for _ in nodes]
         
         for conn in connections:
-            source_port = conn.sourcePortId if hasattr(conn, 'sourcePortId') else getattr(conn, 'source_port_id', '')
-            target_port = conn.targetPortId if hasattr(conn, 'targetPortId') else getattr(conn, 'target_port_id', '')
-            adjacency[conn.sourceNodeId].append((conn.targetNodeId, source_port, target_port))
-            incoming[conn.targetNodeId].append((conn.sourceNodeId, source_port, target_port))
-        
-        # Identify node types
-        if_condition_nodes = {nid for nid, node in nodes.items() if node.type == "if-condition"}
-        rag_nodes = {nid for nid, node in nodes.items() if node.type == "rag-documents"}
-        sheets_nodes = {nid for nid, node in nodes.items() if node.type == "google-sheets"}
-        ai_model_nodes = {nid for nid, node in nodes.items() if node.type == "ai-model"}
-        input_nodes = {nid for nid, node in nodes.items() if node.type in ("text-input", "voice-input")}
+            source_port = conn.sourcePortId.casefold()
+            is_true = "true" in source_port
+            is_false = "false" in source_port
+            source_ix = id2ix[conn.sourceNodeId]
+            target_ix = id2ix[conn.targetNodeId]
+            adjacency[source_ix].append((target_ix, is_true, is_false, conn.targetPortId))
+            incoming[target_ix].append((source_ix, is_true, is_false, conn.targetPortId))
+        
+        # Identify node types in one pass
+        nodes_by_type: Dict[str, set] = {
+            "if-condition": set(),
+            "rag-documents": set(),
+            "google-sheets": set(),
+            "ai-model": set(),
+            "text-input": set(),
+            "voice-input": set(),
+        }
+        for ix, node in enumerate(nodes):
+            bucket = nodes_by_type.get(node.type)
+            if bucket is not None:
+                bucket.add(ix)
+        if_condition_nodes = frozenset(nodes_by_type["if-condition"])
+        rag_nodes = frozenset(nodes_by_type["rag-documents"])
+        sheets_nodes = frozenset(nodes_by_type["google-sheets"])
+        ai_model_nodes = frozenset(nodes_by_type["ai-model"])
+        input_nodes = frozenset(nodes_by_type["text-input"] | nodes_by_type["voice-input"])
         
         # Find which RAG nodes connect to which AI models (via context port)
-        rag_to_ai: Dict[str, str] = {}  # rag_id -> ai_id
-        ai_from_rag: Dict[str, str] = {}  # ai_id -> rag_id
-        for rag_id in rag_nodes:
-            for target_id, source_port, target_port in adjacency.get(rag_id, []):
-                if target_id in ai_model_nodes:
-                    rag_to_ai[rag_id] = target_id
-                    ai_from_rag[target_id] = rag_id
+        rag_to_ai: Dict[int, int] = {}  # rag_ix -> ai_ix
+        ai_from_rag: Dict[int, int] = {}  # ai_ix -> rag_ix
+        for rag_ix in rag_nodes:
+            for target_ix, _, _, _ in adjacency[rag_ix]:
+                if target_ix in ai_model_nodes:
+                    rag_to_ai[rag_ix] = target_ix
+                    ai_from_rag[target_ix] = rag_ix
         
         # Find which Google Sheets nodes connect to which AI models (via context port)
-        sheets_to_ai: Dict[str, str] = {}  # sheets_id -> ai_id
-        ai_from_sheets: Dict[str, str] = {}  # ai_id -> sheets_id
-        for sheets_id in sheets_nodes:
-            for target_id, source_port, target_port in adjacency.get(sheets_id, []):
-                if target_id in ai_model_nodes:
-                    sheets_to_ai[sheets_id] = target_id
-                    ai_from_sheets[target_id] = sheets_id
-        
-        logger.info(f"RAG to AI mappings: {rag_to_ai}")
-        logger.info(f"Sheets to AI mappings: {sheets_to_ai}")
-        
-        # Add all nodes to graph
-        for node_id, node in nodes.items():
+        sheets_to_ai: Dict[int, int] = {}  # sheets_ix -> ai_ix
+        ai_from_sheets: Dict[int, int] = {}  # ai_ix -> sheets_ix
+        for sheets_ix in sheets_nodes:
+            for target_ix, _, _, _ in adjacency[sheets_ix]:
+                if target_ix in ai_model_nodes:
+                    sheets_to_ai[sheets_ix] = target_ix
+                    ai_from_sheets[target_ix] = sheets_ix
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("RAG to AI mappings: %s", {ix2id[r]: ix2id[a] for r, a in rag_to_ai.items()})
+            logger.info("Sheets to AI mappings: %s", {ix2id[s]: ix2id[a] for s, a in sheets_to_ai.items()})
+        
+        # Reject loops of plain edges (Kahn's algorithm, with edges out of
+        # if-condition nodes left out): a loop through a condition can end when
+        # the condition changes, but a loop of plain edges would run until
+        # LangGraph's recursion limit.
+        indegree = [0] * len(nodes)
+        for source_ix, targets in enumerate(adjacency):
+            if source_ix not in if_condition_nodes:
+                for target_ix, _, _, _ in targets:
+                    indegree[target_ix] += 1
+        queue = deque(ix for ix, degree in enumerate(indegree) if degree == 0)
+        sorted_count = 0
+        while queue:
+            source_ix = queue.popleft()
+            sorted_count += 1
+            if source_ix in if_condition_nodes:
+                continue
+            for target_ix, _, _, _ in adjacency[source_ix]:
+                indegree[target_ix] -= 1
+                if indegree[target_ix] == 0:
+                    queue.append(target_ix)
+        if sorted_count < len(nodes):
+            cyclic = [ix2id[ix] for ix, degree in enumerate(indegree) if degree > 0]
+            raise ValueError(f"Workflow has a cycle without an if-condition node: {cyclic}")
+        
+        # Topological order over all edges: reverse DFS postorder, starting from
+        # nodes without incoming connections. Every node comes after the nodes
+        # feeding it, except across a loop back through an if-condition.
+        order: List[int] = []
+        seen = [False] * len(nodes)
+        roots = [ix for ix, sources in enumerate(incoming) if not sources]
+        for root_ix in roots + list(range(len(nodes))):
+            if seen[root_ix]:
+                continue
+            seen[root_ix] = True
+            stack = [(root_ix, iter(adjacency[root_ix]))]
+            while stack:
+                ix, pending = stack[-1]
+                for target_ix, _, _, _ in pending:
+                    if not seen[target_ix]:
+                        seen[target_ix] = True
+                        stack.append((target_ix, iter(adjacency[target_ix])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(ix)
+        order.reverse()
+        
+        # Add all nodes to graph, in topological order
+        for ix in order:
+            node_id, node = ix2id[ix], nodes[ix]
             processor = self._get_processor(node.type)
             if processor:
-                def make_node_fn(proc, data, nid):
-                    def node_fn(state: WorkflowState) -> WorkflowState:
-                        data_with_id = {**data, "id": nid} if isinstance(data, dict) else {"id": nid}
-                        return proc(state, data_with_id)
-                    return node_fn
-                
-                node_data = node.data if hasattr(node, 'data') else {}
-                graph.add_node(node_id, make_node_fn(processor, node_data, node_id))
+                # Node data is read from state at run time, keeping the graph data-independent
+                runner = _arun_node if asyncio.iscoroutinefunction(processor) else _run_node
+                graph.add_node(node_id, functools.partial(runner, processor, node_id))
         
-        # Build edges - must be LINEAR to avoid concurrent updates
-        # Strategy: For each AI model that has a RAG connection, ensure:
-        #   input → RAG → AI model (not input → AI model AND RAG → AI model in parallel)
+        # Build edges
+        # Strategy: for each AI model fed by RAG and/or Sheets, route
+        #   input → RAG ─┐
+        #   input → Sheets ┴→ AI model
+        # instead of input → AI model, so the providers run in the same step and
+        # the AI model runs once after both, with their context in state
         
+        # Edges added so far, packed as (source_ix << 32) | target_ix
         added_edges = set()
         
-        for source_id, targets in adjacency.items():
+        def add_edge(source_ix: int, target_ix: int) -> bool:
+            """Add an edge unless it was already added; return whether it was."""
+            edge = (source_ix << 32) | target_ix
+            if edge in added_edges:
+                return False
+            graph.add_edge(ix2id[source_ix], ix2id[target_ix])
+            added_edges.add(edge)
+            return True
+        
+        for source_ix, targets in enumerate(adjacency):
             if not targets:
                 continue
             
-            source_node = nodes[source_id]
+            source_id = ix2id[source_ix]
             
-            if source_id in if_condition_nodes:
-                # Conditional routing for if-condition nodes
-                true_targets = [t for t, sport, _ in targets if "true" in sport.lower()]
-                false_targets = [t for t, sport, _ in targets if "false" in sport.lower()]
-                
-                def make_router(node_id, true_tgts, false_tgts):
-                    def router(state: WorkflowState) -> str:
-                        result = state.get("condition_results", {}).get(node_id, False)
-                        logger.info(f"Routing from {node_id}: condition={result}")
-                        if result and true_tgts:
-                            return true_tgts[0]
-                        elif not result and false_tgts:
-                            return false_tgts[0]
-                        return END
-                    return router
-                
-                route_map = {t: t for t, _, _ in targets if t in nodes}
-                route_map[END] = END
-                
-                if route_map:
-                    graph.add_conditional_edges(
-                        source_id,
-                        make_router(source_id, true_targets, false_targets),
-                        route_map
-                    )
-                    for t, _, _ in targets:
-                        added_edges.add((source_id, t))
+            if source_ix in if_condition_nodes:
+                # Conditional routing for if-condition nodes; the router returns
+                # node ids directly, so the possible destinations are passed as a list
+                router = functools.partial(
+                    _if_router,
+                    source_id,
+                    tuple(ix2id[t] for t, is_true, _, _ in targets if is_true),
+                    tuple(ix2id[t] for t, _, is_false, _ in targets if is_false),
+                )
+                graph.add_conditional_edges(
+                    source_id,
+                    router,
+                    [ix2id[t] for t, _, _, _ in targets] + [END],
+                )
+                for t, _, _, _ in targets:
+                    added_edges.add((source_ix << 32) | t)
                         
-            elif source_id in input_nodes:
+            elif source_ix in input_nodes:
                 # Input node: check if any target AI model has a RAG or Sheets feeding into it
-                for target_id, _, target_port in targets:
-                    if target_id in ai_model_nodes and target_id in ai_from_rag:
-                        # This AI model has RAG - route input → RAG instead of input → AI
-                        rag_id = ai_from_rag[target_id]
-                        if (source_id, rag_id) not in added_edges:
-                            graph.add_edge(source_id, rag_id)
-                            added_edges.add((source_id, rag_id))
-                            logger.info(f"Redirected input→AI to input→RAG: {source_id} → {rag_id}")
-                    elif target_id in ai_model_nodes and target_id in ai_from_sheets:
-                        # This AI model has Sheets - route input → Sheets instead of input → AI
-                        sheets_id = ai_from_sheets[target_id]
-                        if (source_id, sheets_id) not in added_edges:
-                            graph.add_edge(source_id, sheets_id)
-                            added_edges.add((source_id, sheets_id))
-                            logger.info(f"Redirected input→AI to input→Sheets: {source_id} → {sheets_id}")
-                    elif target_id in rag_nodes:
-                        # Direct input → RAG connection
-                        if (source_id, target_id) not in added_edges:
-                            graph.add_edge(source_id, target_id)
-                            added_edges.add((source_id, target_id))
-                    elif target_id in sheets_nodes:
-                        # Direct input → Sheets connection
-                        if (source_id, target_id) not in added_edges:
-                            graph.add_edge(source_id, target_id)
-                            added_edges.add((source_id, target_id))
+                for target_ix, _, _, target_port in targets:
+                    if target_ix in ai_from_rag or target_ix in ai_from_sheets:
+                        # This AI model has context providers - fan out input → each provider
+                        # instead of input → AI
+                        if target_ix in ai_from_rag:
+                            rag_ix = ai_from_rag[target_ix]
+                            if add_edge(source_ix, rag_ix):
+                                logger.info("Redirected input→AI to input→RAG: %s → %s", source_id, ix2id[rag_ix])
+                        if target_ix in ai_from_sheets:
+                            sheets_ix = ai_from_sheets[target_ix]
+                            if add_edge(source_ix, sheets_ix):
+                                logger.info("Redirected input→AI to input→Sheets: %s → %s", source_id, ix2id[sheets_ix])
                     else:
-                        # Normal connection
-                        if (source_id, target_id) not in added_edges:
-                            graph.add_edge(source_id, target_id)
-                            added_edges.add((source_id, target_id))
+                        # Direct input → RAG/Sheets connection, or a normal connection
+                        add_edge(source_ix, target_ix)
                             
-            elif source_id in rag_nodes:
+            elif source_ix in rag_nodes:
                 # RAG node: connect to its AI model target
-                for target_id, _, _ in targets:
-                    if (source_id, target_id) not in added_edges:
-                        graph.add_edge(source_id, target_id)
-                        added_edges.add((source_id, target_id))
-                        logger.info(f"Added RAG→target edge: {source_id} → {target_id}")
-            elif source_id in sheets_nodes:
+                for target_ix, _, _, _ in targets:
+                    if add_edge(source_ix, target_ix):
+                        logger.info("Added RAG→target edge: %s → %s", source_id, ix2id[target_ix])
+            elif source_ix in sheets_nodes:
                 # Sheets node: connect to its AI model target
-                for target_id, _, _ in targets:
-                    if (source_id, target_id) not in added_edges:
-                        graph.add_edge(source_id, target_id)
-                        added_edges.add((source_id, target_id))
-                        logger.info(f"Added Sheets→target edge: {source_id} → {target_id}")
+                for target_ix, _, _, _ in targets:
+                    if add_edge(source_ix, target_ix):
+                        logger.info("Added Sheets→target edge: %s → %s", source_id, ix2id[target_ix])
             else:
                 # Other nodes: add edges normally
-                for target_id, _, _ in targets:
-                    if (source_id, target_id) not in added_edges:
-                        graph.add_edge(source_id, target_id)
-                        added_edges.add((source_id, target_id))
-        
-        # Find entry nodes (no incoming edges after our modifications)
-        # An entry node is one with no incoming connections in the ORIGINAL graph
-        original_incoming_count = {n.id: 0 for n in workflow.nodes}
-        for conn in connections:
-            original_incoming_count[conn.targetNodeId] += 1
-        
-        entry_candidates = [nid for nid, count in original_incoming_count.items() if count == 0]
-        
-        # Prefer input nodes as entry, then RAG/Sheets if no input
-        input_entries = [nid for nid in entry_candidates if nid in input_nodes]
-        rag_entries = [nid for nid in entry_candidates if nid in rag_nodes]
-        sheets_entries = [nid for nid in entry_candidates if nid in sheets_nodes]
-        
-        if input_entries:
-            graph.set_entry_point(input_entries[0])
-            logger.info(f"Entry point: {input_entries[0]} (input node)")
-        elif rag_entries:
-            graph.set_entry_point(rag_entries[0])
-            logger.info(f"Entry point: {rag_entries[0]} (RAG node)")
-        elif sheets_entries:
-            graph.set_entry_point(sheets_entries[0])
-            logger.info(f"Entry point: {sheets_entries[0]} (Sheets node)")
-        elif entry_candidates:
-            graph.set_entry_point(entry_candidates[0])
-            logger.info(f"Entry point: {entry_candidates[0]}")
+                for target_ix, _, _, _ in targets:
+                    add_edge(source_ix, target_ix)
+        
+        # Find the entry node: one with no incoming connections in the ORIGINAL
+        # graph, preferring input nodes, then RAG, then Sheets, then any other.
+        # Single pass that stops at the first input node.
+        entry_labels = (" (input node)", " (RAG node)", " (Sheets node)", "")
+        entry_ix = None
+        entry_rank = len(entry_labels)
+        for ix, sources in enumerate(incoming):
+            if sources:
+                continue
+            if ix in input_nodes:
+                rank = 0
+            elif ix in rag_nodes:
+                rank = 1
+            elif ix in sheets_nodes:
+                rank = 2
+            else:
+                rank = 3
+            if rank < entry_rank:
+                entry_ix, entry_rank = ix, rank
+                if rank == 0:
+                    break
+        
+        if entry_ix is not None:
+            graph.set_entry_point(ix2id[entry_ix])
+            logger.info("Entry point: %s%s", ix2id[entry_ix], entry_labels[entry_rank])
         
         # Find exit nodes (no outgoing edges)
-        exit_nodes = [nid for nid, targets in adjacency.items() if not targets]
-        for exit_node in exit_nodes:
-            if exit_node not in if_condition_nodes:
-                graph.add_edge(exit_node, END)
+        for ix, targets in enumerate(adjacency):
+            if not targets and ix not in if_condition_nodes:
+                graph.add_edge(ix2id[ix], END)
         
         return graph
     
     def _get_processor(self, node_type: str):
         """Get the processor function for a node type."""
-        processors = {
-            "text-input": self.processors.process_text_input,
-            "ai-model": self.processors.process_ai_model,
-            "rag-documents": self.processors.process_rag_documents,
-            "google-sheets": self.processors.process_google_sheets,
-            "if-condition": self.processors.process_if_condition,
-            "text-output": self.processors.process_text_output,
-            "voice-input": self.processors.process_text_input,  # Same as text for now
-            "voice-output": self.processors.process_text_output,  # Same as text for now
-        }
-        return processors.get(node_type)
+        return self._processors_by_type.get(node_type)
     
     async def execute(
         self,
@@ -1006,13 +2495,18 @@ class WorkflowExecutor:
         conversation_history: List[Dict[str, str]],
         session_id: Optional[str] = None,
         openai_api_key: Optional[str] = None,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> Dict[str, Any]:
-        """Execute a workflow with the given message."""
+        """Execute a workflow with the given message.
+        
+        If `on_token` is given, the output of the AI nodes that produce the
+        answer (see streaming_node_ids()) is passed to it incrementally while
+        the response is generated.
+        """
         
         # Build the graph
         try:
-            graph = self._build_graph(workflow)
-            compiled = graph.compile()
+            compiled = self._get_compiled_graph(workflow)
         except Exception as e:
             logger.exception("Error building graph")
             return {
@@ -1021,24 +2515,24 @@ class WorkflowExecutor:
                 "model_used": None,
             }
         
+        conversation_history, history_summary = await self._window_history(
+            conversation_history, session_id, openai_api_key
+        )
+        
         # Initialize state
-        initial_state: WorkflowState = {
-            "user_message": message,
-            "conversation_history": conversation_history,
-            "current_context": "",
-            "rag_context": None,
-            "sheets_data": None,
-            "condition_results": {},
-            "response": "",
-            "nodes_executed": [],
-            "model_used": None,
-            "output_variables": {},  # Track AI outputs for conditions
-            "openai_api_key": openai_api_key,  # User-provided API key
-        }
+        initial_state = new_workflow_state(
+            message,
+            conversation_history,
+            openai_api_key,
+            on_token,
+            node_data=workflow_node_data(workflow),
+            history_summary=history_summary,
+            stream_node_ids=streaming_node_ids(workflow) if on_token else frozenset(),
+        )
         
         # Execute the graph
         try:
-            final_state = compiled.invoke(initial_state)
+            final_state = await compiled.ainvoke(initial_state)
             return {
                 "response": final_state.get("response", "No response generated"),
                 "nodes_executed": final_state.get("nodes_executed", []),
@@ -1054,15 +2548,101 @@ class WorkflowExecutor:
                 "model_used": None,
             }
     
+    async def _window_history(
+        self,
+        conversation_history: Optional[List[Dict[str, str]]],
+        session_id: Optional[str],
+        openai_api_key: Optional[str],
+    ) -> tuple:
+        """
+        Keep the last `history_window` messages of the conversation. When the
+        history is more than twice that long and the session is known, older
+        messages are replaced by a summary; older messages the summary doesn't
+        cover yet are kept as they are.
+        
+        Returns:
+            (messages, summary): the messages kept and the summary of the ones
+            before them, or None
+        """
+        window = get_env_config().history_window
+        if not conversation_history or window <= 0 or len(conversation_history) <= window:
+            return conversation_history or [], None
+        
+        recent = conversation_history[-window:]
+        if len(conversation_history) <= 2 * window or not session_id or not openai_api_key:
+            return recent, None
+        
+        older = conversation_history[:-window]
+        summary, covered = await self._summarize_history(session_id, older, openai_api_key, window)
+        if not summary:
+            return recent, None
+        return [*older[covered:], *recent], summary
+    
+    async def _summarize_history(
+        self,
+        session_id: str,
+        older: List[Dict[str, str]],
+        openai_api_key: str,
+        window: int,
+    ) -> tuple:
+        """
+        Summary of the start of `older` for a session, cached per session. The
+        summary is only extended (previous summary + newer messages) once
+        `window` more messages have left the window, so most turns reuse it
+        as-is; it is reused only while the messages it covers are unchanged.
+        
+        Returns:
+            (summary, covered): the summary (None on failure) and how many
+            messages of `older` it covers
+        """
+        covered, summary = 0, ""
+        cached = self._history_summaries.get(session_id)
+        if cached is not None:
+            cached_covered, digest, cached_summary = cached
+            if cached_covered <= len(older) and self._history_digest(older[:cached_covered]) == digest:
+                covered, summary = cached_covered, cached_summary
+                if len(older) < covered + window:
+                    self._history_summaries.move_to_end(session_id)
+                    return summary, covered
+            # Otherwise the history was reset or edited; start over
+        
+        transcript = "\n".join(
+            f"{msg.get('role', 'user')}: {msg.get('content', '')}" for msg in older[covered:]
+        )
+        if summary:
+            transcript = f"Summary so far: {summary}\n\n{transcript}"
+        
+        try:
+            llm = get_chat_model(HISTORY_SUMMARY_MODEL, 0.0, openai_api_key)
+            new_summary = await astream_llm(
+                llm, [SystemMessage(content=HISTORY_SUMMARY_PROMPT), HumanMessage(content=transcript)]
+            )
+        except Exception:
+            logger.exception("Error summarizing conversation history")
+            return (summary or None), covered
+        
+        self._history_summaries[session_id] = (len(older), self._history_digest(older), new_summary)
+        self._history_summaries.move_to_end(session_id)
+        while len(self._history_summaries) > self.HISTORY_SUMMARY_CACHE_SIZE:
+            self._history_summaries.popitem(last=False)
+        return new_summary, len(older)
+    
+    @staticmethod
+    def _history_digest(messages: List[Dict[str, str]]) -> str:
+        """Hash of the roles and contents of conversation messages."""
+        return hashlib.sha256(
+            orjson.dumps([[msg.get("role", "user"), msg.get("content", "")] for msg in messages])
+        ).hexdigest()
+    
     def validate_workflow(self, workflow) -> Dict[str, Any]:
         """Validate a workflow configuration."""
         nodes = workflow.nodes
         connections = workflow.connections
         
         # Check for required nodes
-        node_types = [n.type for n in nodes]
-        has_input = "text-input" in node_types or "voice-input" in node_types
-        has_output = "text-output" in node_types or "voice-output" in node_types
+        node_types = {n.type for n in nodes}
+        has_input = not node_types.isdisjoint(INPUT_NODE_TYPES)
+        has_output = not node_types.isdisjoint(OUTPUT_NODE_TYPES)
         has_ai = "ai-model" in node_types
         
         issues = []
@@ -1079,7 +2659,7 @@ class WorkflowExecutor:
             connected_nodes.add(conn.sourceNodeId)
             connected_nodes.add(conn.targetNodeId)
         
-        orphans = [n.id for n in nodes if n.id not in connected_nodes and len(nodes) > 1]
+        orphans = [n.id for n in nodes if n.id not in connected_nodes] if len(nodes) > 1 else []
         if orphans:
             issues.append(f"Orphan nodes (not connected): {orphans}")
         
@@ -1088,7 +2668,7 @@ class WorkflowExecutor:
             "issues": issues,
             "node_count": len(nodes),
             "connection_count": len(connections),
-            "node_types": list(set(node_types)),
+            "node_types": list(node_types),
         }
     
     def get_workflow_type(self, workflow) -> Dict[str, Any]: